@@ -0,0 +1,605 @@
+import os, stat, json, queue, tarfile, zlib, struct, time, hashlib, threading, collections, concurrent.futures
+import report, utils
+
+try:
+    import pwd, grp
+except ImportError:
+    pwd = grp = None
+
+# zstd comes from the standard library on python 3.14+ or from the optional zstandard package
+try:
+    from compression import zstd as _zstd
+
+    def zstd_compress(data, level):
+        return _zstd.compress(data, level=level)
+
+    def zstd_decompress(data):
+        return _zstd.decompress(data)
+except ImportError:
+    try:
+        import zstandard as _zstd
+
+        def zstd_compress(data, level):
+            return _zstd.ZstdCompressor(level=level).compress(data)
+
+        def zstd_decompress(data):
+            return _zstd.ZstdDecompressor().decompress(data)
+    except ImportError:
+        zstd_compress = zstd_decompress = None
+
+COMPRESS_EXTENSIONS = {'gzip': 'tgz', 'store': 'tar', 'zstd': 'tzst'}
+# suffixes of compressed command output, which isn't a tar stream
+STREAM_EXTENSIONS = {'gzip': '.gz', 'store': '', 'zstd': '.zst'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+READ_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 10
+INDEX_EXTENSION = ".idx"
+INDEX_VERSION = 1
+# chunks of the tar stream buffered for every destination of a fan-out
+FANOUT_QUEUE_SIZE = 16
+
+class Stats:
+    bytes_in = 0
+    bytes_out = 0
+    files = 0
+    started = None
+    checksum = None
+    index = None
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def ratio(self):
+        if self.bytes_out == 0:
+            return 0.0
+        return self.bytes_in / self.bytes_out
+
+    def format(self):
+        elapsed = max(self.elapsed(), 0.001)
+        return "{0} files, {1} -> {2} in {3:.1f}s (in {4}/s, out {5}/s, ratio {6:.2f})".format(
+            self.files, utils.format_size(self.bytes_in), utils.format_size(self.bytes_out), elapsed,
+            utils.format_size(self.bytes_in / elapsed), utils.format_size(self.bytes_out / elapsed), self.ratio())
+
+class ProgressReporter(threading.Thread):
+    def __init__(self, stats, interval=PROGRESS_INTERVAL):
+        super().__init__(daemon=True)
+        self.stats = stats
+        self.interval = interval
+        self.section = report.get_section()
+        self.stopped = threading.Event()
+
+    def run(self):
+        with report.use_section(self.section):
+            while not self.stopped.wait(self.interval):
+                report.log_progress(self.stats.format())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+# the checksum is computed on the written stream, the archive isn't read back
+class CountingWriter:
+    def __init__(self, f, stats, throttle=None, checksum=None):
+        self.f = f
+        self.stats = stats
+        self.throttle = throttle
+        self.algorithm = checksum
+        self.hash = hashlib.new(checksum) if checksum else None
+
+    def write(self, data):
+        if self.throttle is not None:
+            self.throttle.consume_write(len(data))
+        self.f.write(data)
+        self.stats.bytes_out += len(data)
+        if self.hash is not None:
+            self.hash.update(data)
+
+    def get_checksum(self):
+        if self.hash is None:
+            return None
+        return "{0}:{1}".format(self.algorithm, self.hash.hexdigest())
+
+class StoreCompressor:
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, data):
+        self.out.write(data)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+class BlockCompressor:
+    block_size = 128 * 1024
+    # (uncompressed, compressed) offsets of the blocks, recorded for seekable archives
+    blocks = None
+
+    def __init__(self, out, threads, level, throttle=None):
+        self.out = out
+        self.level = level
+        self.throttle = throttle
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        # bounds memory use, compressed blocks have to be written in order anyway
+        self.max_pending = threads * 2
+        self.pending = collections.deque()
+        self.buf = bytearray()
+        self.prev_block = None
+        self.u_offset = 0
+        self.c_offset = 0
+        self.write_header()
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) < self.block_size:
+            return
+
+        view = memoryview(self.buf)
+        pos = 0
+        while len(self.buf) - pos >= self.block_size:
+            self.submit(bytes(view[pos:pos + self.block_size]), False)
+            pos += self.block_size
+        view.release()
+        del self.buf[:pos]
+
+    def submit(self, block, last):
+        self.update(block)
+        if self.throttle is not None:
+            future = self.pool.submit(self.throttle.run_cpu, self.compress_block, block, self.prev_block, last)
+        else:
+            future = self.pool.submit(self.compress_block, block, self.prev_block, last)
+        self.pending.append((future, len(block)))
+        self.prev_block = block
+        while len(self.pending) > self.max_pending:
+            self.write_block(*self.pending.popleft())
+
+    def write_block(self, future, size):
+        data = future.result()
+        if self.blocks is not None and data:
+            self.blocks.append((self.u_offset, self.c_offset))
+        self.out.write(data)
+        self.u_offset += size
+        self.c_offset += len(data)
+
+    def close(self):
+        self.submit(bytes(self.buf), True)
+        self.buf = bytearray()
+        while self.pending:
+            self.write_block(*self.pending.popleft())
+        self.pool.shutdown()
+        self.write_trailer()
+
+    def abort(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def write_header(self):
+        pass
+
+    def write_trailer(self):
+        pass
+
+    def update(self, block):
+        pass
+
+    def compress_block(self, block, prev_block, last):
+        raise NotImplementedError()
+
+class GzipCompressor(BlockCompressor):
+    # blocks are raw deflate streams ended with a sync flush, primed with the tail
+    # of the previous block, so together they form a single regular gzip member
+    dict_size = 32 * 1024
+
+    crc = 0
+    size = 0
+
+    def write_header(self):
+        self.out.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) + b"\x00\x03")
+
+    def write_trailer(self):
+        self.out.write(struct.pack("<II", self.crc & 0xffffffff, self.size & 0xffffffff))
+
+    def update(self, block):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+
+    def compress_block(self, block, prev_block, last):
+        if prev_block:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=prev_block[-self.dict_size:])
+        else:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return c.compress(block) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class SeekableGzipCompressor(BlockCompressor):
+    # every block is a complete gzip member, so it can be decompressed on its own;
+    # concatenated members are still a valid gzip file
+    block_size = 1024 * 1024
+
+    def compress_block(self, block, prev_block, last):
+        if not block:
+            return b""
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return c.compress(block) + c.flush()
+
+class ZstdCompressor(BlockCompressor):
+    # every block is an independent zstd frame, concatenated frames are a valid zstd stream
+    block_size = 4 * 1024 * 1024
+
+    def compress_block(self, block, prev_block, last):
+        if not block:
+            return b""
+        return zstd_compress(block, self.level)
+
+def make_compressor(compress, out, threads=None, level=None, throttle=None, seekable=False):
+    if compress == 'store':
+        return StoreCompressor(out)
+
+    threads = threads or os.cpu_count() or 1
+    if level is None:
+        level = DEFAULT_LEVELS[compress]
+    if compress == 'gzip':
+        compressor = (SeekableGzipCompressor if seekable else GzipCompressor)(out, threads, level, throttle)
+    elif compress == 'zstd':
+        compressor = ZstdCompressor(out, threads, level, throttle)
+    else:
+        raise ValueError("unknown compression: {0}".format(compress))
+    if seekable:
+        compressor.blocks = []
+    return compressor
+
+class TarWriter:
+    def __init__(self, out, stats, on_warning, throttle=None):
+        self.out = out
+        self.stats = stats
+        self.on_warning = on_warning
+        self.throttle = throttle
+        self.offset = 0
+        self.inodes = {}
+        self.unames = {}
+        self.gnames = {}
+        self.errors = 0
+        # (name, offset) of every member, recorded for seekable archives
+        self.members = None
+        # with a snapshot only changed entries are archived, directories always are
+        self.snapshot = None
+
+    def write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+        self.stats.bytes_in += len(data)
+
+    def warn(self, msg):
+        self.on_warning(msg)
+
+    def error(self, msg):
+        self.errors += 1
+        self.on_warning(msg)
+
+    def get_uname(self, uid):
+        if uid not in self.unames:
+            try:
+                self.unames[uid] = pwd.getpwuid(uid)[0] if pwd else ""
+            except KeyError:
+                self.unames[uid] = ""
+        return self.unames[uid]
+
+    def get_gname(self, gid):
+        if gid not in self.gnames:
+            try:
+                self.gnames[gid] = grp.getgrgid(gid)[0] if grp else ""
+            except KeyError:
+                self.gnames[gid] = ""
+        return self.gnames[gid]
+
+    def make_tarinfo(self, path, arcname, st):
+        tarinfo = tarfile.TarInfo(arcname)
+        mode = st.st_mode
+        if stat.S_ISREG(mode):
+            inode = (st.st_dev, st.st_ino)
+            if st.st_nlink > 1 and inode in self.inodes:
+                tarinfo.type = tarfile.LNKTYPE
+                tarinfo.linkname = self.inodes[inode]
+            else:
+                tarinfo.type = tarfile.REGTYPE
+                tarinfo.size = st.st_size
+        elif stat.S_ISDIR(mode):
+            tarinfo.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            tarinfo.type = tarfile.SYMTYPE
+            tarinfo.linkname = os.readlink(path)
+        elif stat.S_ISFIFO(mode):
+            tarinfo.type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+            tarinfo.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) else tarfile.BLKTYPE
+            tarinfo.devmajor = os.major(st.st_rdev)
+            tarinfo.devminor = os.minor(st.st_rdev)
+        else:
+            return None
+
+        tarinfo.mode = stat.S_IMODE(mode)
+        tarinfo.uid = st.st_uid
+        tarinfo.gid = st.st_gid
+        tarinfo.uname = self.get_uname(st.st_uid)
+        tarinfo.gname = self.get_gname(st.st_gid)
+        tarinfo.mtime = int(st.st_mtime)
+        return tarinfo
+
+    def add(self, tarinfo):
+        if self.members is not None:
+            self.members.append((tarinfo.name, self.offset))
+        self.write(tarinfo.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape"))
+        self.stats.files += 1
+
+    # returns whether the file made it into the archive
+    def add_file(self, path, tarinfo):
+        try:
+            f = open(path, "rb", buffering=0)
+        except FileNotFoundError:
+            self.warn("{0}: File removed before we read it".format(tarinfo.name))
+            return False
+        except OSError as e:
+            self.error("{0}: Cannot open: {1}".format(tarinfo.name, e.strerror))
+            return False
+
+        with f:
+            self.add(tarinfo)
+            remaining = tarinfo.size
+            while remaining > 0:
+                chunk = f.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                if self.throttle is not None:
+                    self.throttle.consume_read(len(chunk))
+                self.write(chunk)
+                remaining -= len(chunk)
+
+            if remaining > 0:
+                self.warn("{0}: File shrank by {1} bytes; padding with zeros".format(tarinfo.name, remaining))
+                while remaining > 0:
+                    n = min(READ_SIZE, remaining)
+                    self.write(bytes(n))
+                    remaining -= n
+            elif f.read(1):
+                self.warn("{0}: file changed as we read it".format(tarinfo.name))
+
+        self.pad(tarfile.BLOCKSIZE)
+        return True
+
+    def pad(self, size):
+        rest = self.offset % size
+        if rest:
+            self.write(bytes(size - rest))
+
+    def list_dir(self, path, arcname):
+        try:
+            with os.scandir(path) as it:
+                return iter(sorted(it, key=lambda e: e.name))
+        except OSError as e:
+            self.error("{0}: Cannot open: {1}".format(arcname, e.strerror))
+            return iter(())
+
+    # select limits the top-level entries that are archived
+    def add_tree(self, src_dir, select=None):
+        tarinfo = self.make_tarinfo(src_dir, ".", os.lstat(src_dir))
+        self.add(tarinfo)
+
+        it = self.list_dir(src_dir, ".")
+        if select is not None:
+            it = (e for e in it if select(e.name))
+        stack = [(".", it)]
+        while stack:
+            arcname, it = stack[-1]
+            e = next(it, None)
+            if e is None:
+                stack.pop()
+                continue
+
+            child_arcname = arcname + "/" + e.name
+            try:
+                st = e.stat(follow_symlinks=False)
+                tarinfo = self.make_tarinfo(e.path, child_arcname, st)
+            except FileNotFoundError:
+                self.warn("{0}: File removed before we read it".format(child_arcname))
+                continue
+
+            if tarinfo is not None and self.snapshot is not None:
+                if not self.snapshot.check(child_arcname, st) and not tarinfo.isdir():
+                    continue
+
+            if tarinfo is None:
+                self.warn("{0}: socket ignored".format(child_arcname))
+            elif tarinfo.isreg():
+                # later links to the inode point at the first one actually archived
+                if self.add_file(e.path, tarinfo) and st.st_nlink > 1:
+                    self.inodes[(st.st_dev, st.st_ino)] = child_arcname
+            else:
+                self.add(tarinfo)
+                if tarinfo.isdir():
+                    stack.append((child_arcname, self.list_dir(e.path, child_arcname)))
+
+    def close(self):
+        self.write(bytes(tarfile.BLOCKSIZE * 2))
+        self.pad(tarfile.RECORDSIZE)
+
+def create_archive(src_dir, f, compress, threads=None, level=None, on_warning=report.log_warn, throttle=None, checksum=None,
+                   select=None, stats=None, progress=True, seekable=False, snapshot=None):
+    stats = stats or Stats()
+    out = CountingWriter(f, stats, throttle, checksum)
+    compressor = make_compressor(compress, out, threads=threads, level=level, throttle=throttle, seekable=seekable)
+    tar = TarWriter(compressor, stats, on_warning, throttle)
+    tar.snapshot = snapshot
+    if seekable:
+        tar.members = []
+
+    progress = ProgressReporter(stats) if progress else None
+    if progress is not None:
+        progress.start()
+    try:
+        tar.add_tree(src_dir, select)
+        tar.close()
+        compressor.close()
+    except BaseException:
+        compressor.abort()
+        raise
+    finally:
+        if progress is not None:
+            progress.stop()
+
+    stats.checksum = out.get_checksum()
+    if seekable:
+        stats.index = make_index(compress, getattr(compressor, 'blocks', None) or [], tar.members)
+    return stats, tar.errors
+
+class FanoutStats(Stats):
+    def __init__(self, stats, sinks):
+        super().__init__()
+        self.tar_stats = stats
+        self.sinks = sinks
+
+    @property
+    def bytes_in(self):
+        return self.tar_stats.bytes_in
+
+    @property
+    def files(self):
+        return self.tar_stats.files
+
+    @property
+    def bytes_out(self):
+        return sum(s.stats.bytes_out for s in self.sinks)
+
+# compresses the tar stream for one destination in its own thread, a failure stops only this destination
+class FanoutSink(threading.Thread):
+    def __init__(self, f, compress, threads=None, level=None, throttle=None, checksum=None, seekable=False, queue_size=FANOUT_QUEUE_SIZE):
+        super().__init__(daemon=True)
+        self.stats = Stats()
+        self.out = CountingWriter(f, self.stats, throttle, checksum)
+        self.compressor = make_compressor(compress, self.out, threads=threads, level=level, throttle=throttle, seekable=seekable)
+        self.compress = compress
+        self.seekable = seekable
+        # bounded, the slowest destination holds back reading the source
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.aborted = False
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.compressor.write(data)
+            except Exception as e:
+                self.fail(e)
+
+        if self.error is None:
+            try:
+                if self.aborted:
+                    self.compressor.abort()
+                else:
+                    self.compressor.close()
+            except Exception as e:
+                self.fail(e)
+
+    def fail(self, e):
+        self.error = e
+        self.compressor.abort()
+
+class Tee:
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= READ_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buf:
+            return
+        data = bytes(self.buf)
+        self.buf = bytearray()
+        sinks = [s for s in self.sinks if s.error is None]
+        if not sinks:
+            raise self.sinks[0].error
+        for sink in sinks:
+            sink.queue.put(data)
+
+# the source is read once and the tar stream is compressed for every sink in parallel
+def create_fanout(src_dir, sinks, on_warning=report.log_warn, throttle=None):
+    stats = Stats()
+    tee = Tee(sinks)
+    tar = TarWriter(tee, stats, on_warning, throttle)
+    if any(s.seekable for s in sinks):
+        tar.members = []
+
+    for sink in sinks:
+        sink.start()
+    progress = ProgressReporter(FanoutStats(stats, sinks))
+    progress.start()
+    try:
+        tar.add_tree(src_dir)
+        tar.close()
+        tee.flush()
+    except BaseException:
+        for sink in sinks:
+            sink.aborted = True
+        raise
+    finally:
+        for sink in sinks:
+            sink.queue.put(None)
+        for sink in sinks:
+            sink.join()
+        progress.stop()
+
+    for sink in sinks:
+        sink.stats.bytes_in = stats.bytes_in
+        sink.stats.files = stats.files
+        sink.stats.checksum = sink.out.get_checksum()
+        if sink.seekable:
+            sink.stats.index = make_index(sink.compress, sink.compressor.blocks or [], tar.members)
+    return stats, tar.errors
+
+# compresses whatever src yields, the output of a command like a database dump
+def create_stream(src, f, compress, threads=None, level=None, throttle=None, checksum=None):
+    stats = Stats()
+    stats.files = 1
+    out = CountingWriter(f, stats, throttle, checksum)
+    compressor = make_compressor(compress, out, threads=threads, level=level, throttle=throttle)
+
+    progress = ProgressReporter(stats)
+    progress.start()
+    try:
+        for chunk in iter(lambda: src.read(READ_SIZE), b""):
+            if throttle is not None:
+                throttle.consume_read(len(chunk))
+            stats.bytes_in += len(chunk)
+            compressor.write(chunk)
+        compressor.close()
+    except BaseException:
+        compressor.abort()
+        raise
+    finally:
+        progress.stop()
+
+    stats.checksum = out.get_checksum()
+    return stats
+
+# maps the members to offsets in the tar stream and the blocks to offsets in the compressed file,
+# restore.py uses it to decompress only the blocks holding the wanted members
+def make_index(compress, blocks, members):
+    data = {
+        'version': INDEX_VERSION,
+        'compress': compress,
+        'blocks': blocks,
+        'members': members,
+    }
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode())
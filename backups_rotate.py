@@ -1,28 +1,44 @@
-import os, sys, argparse, time, subprocess, configparser, shutil, select, traceback, shlex
+import os, sys, traceback, functools, math, threading, hashlib
 from datetime import datetime, timedelta
-import utils, report
-import ago, yaml
+import utils, report, planner, scheduler, trash, metrics, procio, fingerprint, throttle, storage
 
-report.init()
+# archive, copier, verify, yaml, ago and the mail modules are imported where they are used,
+# so a run with nothing to do and embedding applications don't pay for them
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--config", required=True)
-parser.add_argument("--force", action='store_true')
-parser.add_argument("--basedate")
-args = parser.parse_args()
+# configs without backup tasks are rotated this often in daemon mode
+ROTATE_ONLY_INTERVAL = 60 * 60
+DEFAULT_POLL = 60
+DEFAULT_RETRY_DELAY = "10m"
+CONFIG_EXTENSIONS = (".cfg", ".yml", ".yaml")
+# backups that can be verified against their checksums
+ARCHIVE_KINDS = ('file', 'sharded')
 
-config = yaml.load(open(args.config))
+class Context:
+    base_date = None
+    force = False
+    dry_run = False
+    jobs = None
 
-report.log_name(config['name'])
+    def __init__(self, base_date=None, force=False, dry_run=False, jobs=None):
+        self.base_date = base_date
+        self.force = force
+        self.dry_run = dry_run
+        self.jobs = jobs
 
-base_date = datetime.now()
-if args.basedate:
-    base_date = datetime.strptime(args.basedate, "%Y-%m-%d")
+    def for_run(self):
+        # a run without a fixed base date is performed at the time it starts
+        return Context(self.base_date or datetime.now(), self.force, self.dry_run, self.jobs)
+
+def load_config(path):
+    import yaml
+    with open(path) as f:
+        return yaml.safe_load(f)
 
 def ago_format(x):
     if x < timedelta(minutes=1):
         return "now"
     else:
+        import ago
         return ago.human(x)
 
 class BackupException(Exception):
@@ -49,19 +65,29 @@ class BackupException(Exception):
 
 class Task:
     name = None
+    ctx = None
 
     dest_dir = None
+    storage = None
+    throttle = None
+    output_tail_size = None
 
-    def __init__(self, config):
+    def __init__(self, config, ctx):
+        self.ctx = ctx
         self.dest_dir = config['dest']
         self.name = config['name']
 
         self.dest_dir = self.dest_dir.rstrip("/") + "/"
 
-        if not os.path.isabs(self.dest_dir):
-            raise BackupException("Destination directory - path must be absolute: {0}".format(self.dest_dir))
-        if not os.path.exists(self.dest_dir):
-            raise BackupException("Destination directory doesn't exist: {0}".format(self.dest_dir))
+        if not storage.is_remote(self.dest_dir):
+            if not os.path.isabs(self.dest_dir):
+                raise BackupException("Destination directory - path must be absolute: {0}".format(self.dest_dir))
+            if not os.path.exists(self.dest_dir):
+                raise BackupException("Destination directory doesn't exist: {0}".format(self.dest_dir))
+        try:
+            self.storage = storage.get_storage(self.dest_dir, config)
+        except ValueError as e:
+            raise BackupException(str(e))
 
         # if self.name is None:
             # raise BackupException("name must be specified".format(self.src_dir))
@@ -71,107 +97,298 @@ class Task:
             txt = txt.replace(v[1].rstrip('/'), "<{0}>".format(v[0]))
         return txt
 
-    def process_vars(self, rpl):
+    def set_vars(self, rpl):
         self.rpl = sorted(rpl, key=lambda x: -len(x[1]))
+
+    def process_vars(self, rpl):
+        self.set_vars(rpl)
         report.log_msg("Variables:")
         for var in self.rpl:
             report.log_state("{0:>16s} = {1}".format("<{0}>".format(var[0]), var[1]))
 
+    # warnings are printed as they come, only the last ones are kept for the report
+    def capture_output(self):
+        output = procio.OutputTail(self.output_tail_size)
+        def on_warning(line):
+            output.add(line)
+            report.log_output(line)
+        return output, on_warning
+
+    def log_output(self, output):
+        if output.lines_total:
+            report.log_html("<pre>" + report.html_escape(output.get()) + "</pre>")
+
+    def log_throttle(self):
+        if self.throttle.is_active():
+            report.log_msg("Throttling: {0}".format(self.throttle.format()))
+
+    def log_throttle_waited(self):
+        waited = self.throttle.format_waited()
+        if waited:
+            report.log_msg("Waited for limits: {0}".format(waited))
+
 class BackupTask(Task):
     interval = None
 
     src_dir = None
+    src_cmd = None
+    src_ext = None
     do_compress = None
-    cpu_limit = None
+    compress_threads = None
+    compress_level = None
+    throttle = None
+    output_tail_size = None
     check = None
+    incremental = None
+    copy_threads = None
+    skip_if_unchanged = None
+    fingerprint_threads = None
+    fingerprint = None
+    checksum = None
+    shards = None
+    seekable = None
+    full_interval = None
 
-    def __init__(self, config):
-        super().__init__(config)
+    def __init__(self, config, ctx):
+        super().__init__(config, ctx)
 
         self.interval = utils.get_interval_from_str(config['interval'])
         self.do_compress = config['compress']
-        self.cpu_limit = config.get('cpu_limit')
+        self.compress_threads = config.get('compress_threads')
+        self.compress_level = config.get('compress_level')
+        try:
+            self.throttle = throttle.from_config(config)
+        except ValueError as e:
+            raise BackupException(str(e))
+        self.output_tail_size = config.get('output_tail_size', procio.DEFAULT_TAIL_SIZE)
         self.check = config['check']
-        self.src_dir = config['src']
+        self.incremental = config.get('incremental', False)
+        self.full_interval = utils.get_interval_from_str(config.get('full_interval', "7d"))
+        self.copy_threads = config.get('copy_threads')
+        self.skip_if_unchanged = config.get('skip_if_unchanged', False)
+        self.fingerprint_threads = config.get('fingerprint_threads')
+        self.checksum = config.get('checksum', 'sha256')
+        self.shards = config.get('shards')
+        self.seekable = config.get('seekable', False)
+        self.src_dir = config.get('src')
+        self.src_cmd = config.get('src_cmd')
+        self.src_ext = config.get('src_ext', 'dump')
 
-        if not os.path.isabs(self.src_dir):
+        if (self.src_dir is None) == (self.src_cmd is None):
+            raise BackupException("specify one of src or src_cmd")
+        if self.src_cmd is not None:
+            if self.do_compress not in ('gzip', 'store', 'zstd'):
+                raise BackupException("src_cmd output is compressed, compress must be gzip, zstd or store")
+            if self.skip_if_unchanged or self.shards is not None or self.seekable or self.incremental:
+                raise BackupException("skip_if_unchanged, shards, seekable and incremental need a source directory")
+        elif not os.path.isabs(self.src_dir):
             raise BackupException("Source directory - path must be absolute: {0}".format(self.src_dir))
-        if not os.path.exists(self.src_dir):
+        elif not os.path.exists(self.src_dir):
             raise BackupException("Source directory doesn't exist: {0}".format(self.src_dir))
+        if self.throttle.cpu is not None and self.do_compress not in throttle.CPU_LIMITED_COMPRESS:
+            raise BackupException("cpu_limit limits compression, it has no effect with compress: {0}".format(self.do_compress))
+        if self.checksum and self.checksum not in hashlib.algorithms_available:
+            raise BackupException("unknown checksum algorithm: {0}".format(self.checksum))
+        if self.skip_if_unchanged not in (False, True, 'dir_mtime'):
+            raise BackupException("skip_if_unchanged must be true, false or dir_mtime")
+        if not self.storage.is_local and self.do_compress not in ('gzip', 'store', 'zstd'):
+            raise BackupException("Directory copies need a local destination: {0}".format(self.dest_dir))
+        if self.shards is not None:
+            if not isinstance(self.shards, int) or self.shards < 1:
+                raise BackupException("shards must be a positive number")
+            if self.do_compress not in ('gzip', 'store', 'zstd'):
+                raise BackupException("shards need an archive, compress must be gzip, zstd or store")
+            if not self.storage.is_local:
+                raise BackupException("Sharded archives need a local destination: {0}".format(self.dest_dir))
+            if self.incremental:
+                raise BackupException("sharded archives can't be incremental")
+        if self.seekable and self.do_compress not in ('gzip', 'store', 'zstd'):
+            raise BackupException("seekable needs an archive, compress must be gzip, zstd or store")
+        if self.do_compress == 'zstd':
+            import archive
+            if archive.zstd_compress is None:
+                raise BackupException("zstd compression requires python 3.14 or the zstandard package")
 
     def check_if_needed(self):
-        last_date = utils.get_last_date_in_dir(self.dest_dir)
+        with metrics.span("scan") as span:
+            cat = self.storage.load_catalog(write=not self.ctx.dry_run)
+            span.add(files=len(cat.entries))
+        last_date = cat.last_date()
         report.log_msg("Last backup date: {0}".format(last_date))
 
-        if last_date is None or args.force:
-            return True
+        cache = self.load_fingerprint_cache()
+        if cache is not None and cache.checked_at is not None:
+            report.log_msg("Source found unchanged at: {0}".format(cache.checked_at))
+        last_date = self.get_last_check(last_date, cache)
+
+        if last_date is not None and not self.ctx.force:
+            if self.check == 'exact':
+                diff = self.ctx.base_date - last_date
+                report.log_msg("Checking exact: {0}".format(ago_format(diff)))
+            elif self.check == 'daily':
+                diff = self.ctx.base_date.date() - last_date.date()
+                report.log_msg("Checking daily: {0}".format(ago_format(diff)))
+
+            interval = timedelta(seconds=self.interval)
+            if diff < interval:
+                return False
+
+        if cache is not None:
+            return not self.check_source_unchanged(cat, cache) or self.ctx.force
+        return True
+
+    def load_fingerprint_cache(self):
+        if not self.skip_if_unchanged:
+            return None
+        cache = fingerprint.Cache(self.storage, self.name, self.src_dir)
+        cache.read()
+        return cache
+
+    # a source found unchanged counts as backed up at the time of the check
+    def get_last_check(self, last_date, cache):
+        if cache is None or cache.checked_at is None:
+            return last_date
+        if last_date is None or last_date < cache.checked_at:
+            return cache.checked_at
+        return last_date
+
+    def get_stored_fingerprint(self, cat):
+        for entry in reversed(cat.sorted_entries()):
+            if entry.info and entry.info.get('src') == self.src_dir and entry.info.get('fingerprint'):
+                return entry.info['fingerprint']
+        return None
+
+    # directory hashes are cached only for dir_mtime, otherwise every directory is read again anyway
+    def check_source_unchanged(self, cat, cache):
+        trust_dir_mtime = self.skip_if_unchanged == 'dir_mtime'
+        with metrics.span("fingerprint") as span:
+            fp = fingerprint.Fingerprinter(self.src_dir, cache.dirs if trust_dir_mtime else None, trust_dir_mtime=trust_dir_mtime,
+                                           threads=self.fingerprint_threads)
+            self.fingerprint = fp.compute()
+            span.add(files=fp.files)
+        report.log_msg("Source fingerprint: {0}".format(self.fingerprint))
+
+        unchanged = self.fingerprint == self.get_stored_fingerprint(cat)
+        if unchanged:
+            report.log_msg("Source unchanged since the last backup")
+            cache.checked_at = self.ctx.base_date
+        if not self.ctx.dry_run:
+            cache.dirs = fp.cache if trust_dir_mtime else {}
+            cache.save()
+        return unchanged
+
+    def get_backup_info(self):
+        if self.fingerprint is None:
+            return None
+        return {'src': self.src_dir, 'fingerprint': self.fingerprint}
 
-        if self.check == 'exact':
-            diff = base_date - last_date
-            report.log_msg("Checking exact: {0}".format(ago_format(diff)))
-        elif self.check == 'daily':
-            diff = base_date.date() - last_date.date()
-            report.log_msg("Checking daily: {0}".format(ago_format(diff)))
+    def get_due_date(self, last_date):
+        if last_date is None:
+            return None
+        if self.check == 'daily':
+            days = math.ceil(self.interval / (24 * 60 * 60))
+            return datetime.combine(last_date.date(), datetime.min.time()) + timedelta(days=days)
+        return last_date + timedelta(seconds=self.interval)
 
-        interval = timedelta(seconds=self.interval)
-        return diff >= interval
+    def get_next_due(self):
+        last_date = self.storage.load_catalog(write=False).last_date()
+        return self.get_due_date(self.get_last_check(last_date, self.load_fingerprint_cache()))
 
     def perform(self):
         if not self.check_if_needed():
             return
 
-        dest_file_name = base_date.strftime("%Y-%m-%d_%H%M%S_") + utils.get_valid_filename(self.name)
+        dest_file_name = self.ctx.base_date.strftime("%Y-%m-%d_%H%M%S_") + utils.get_valid_filename(self.name)
+
+        if self.ctx.dry_run:
+            report.log_msg("Dry run, would create backup {0}".format(dest_file_name))
+            return
+
+        import archive
 
         self.process_vars([
             ['DEST_FILENAME', dest_file_name],
-            ['SRC_DIR', self.src_dir],
+            ['SRC_DIR', self.src_dir] if self.src_cmd is None else ['SRC_CMD', self.src_cmd],
             ['DEST_DIR', self.dest_dir],
         ])
 
         dest_path = self.dest_dir + dest_file_name
 
-        if self.do_compress in ['gzip', 'store']:
-            ext = {'gzip': 'tgz', 'store': 'tar'}[self.do_compress]
+        if self.do_compress in archive.COMPRESS_EXTENSIONS:
+            ext = archive.COMPRESS_EXTENSIONS[self.do_compress]
+
+            state = snap = parent = None
+            if self.incremental and self.src_cmd is None and not self.shards:
+                state, snap, parent = self.load_chain()
 
-            dest_path_compressed = self.dest_dir + dest_file_name + "." + ext
-            if os.path.exists(dest_path_compressed):
+            if self.src_cmd is not None:
+                dest_name = dest_file_name + "." + self.src_ext + archive.STREAM_EXTENSIONS[self.do_compress]
+            elif parent is not None:
+                import snapshot
+                dest_name = dest_file_name + snapshot.INCREMENTAL_MARKER + ext
+            else:
+                dest_name = dest_file_name + (utils.sharded_extension if self.shards else "." + ext)
+            dest_path_compressed = self.dest_dir + dest_name
+            if self.storage.exists(dest_name):
                 report.log_warn("Destination file exists {0}".format(self.cc(dest_path_compressed)))
                 return
 
-            dest_path_compressed_tmp = dest_path_compressed + ".tmp"
-
-            report.log_state("Changing directory to {0}".format(self.cc(self.src_dir)))
-            os.chdir(self.src_dir)
-
-            report.log_state("Creating archive {0} to {1}...".format(self.cc(self.src_dir), self.cc(dest_path_compressed_tmp)))
+            report.log_state("Creating archive {0} to {1}...".format(self.cc(self.src_dir or self.src_cmd), self.cc(dest_path_compressed)))
 
-            if self.do_compress == 'gzip':
-                cmd = "tar --create . | pigz > {0}".format(shlex.quote(dest_path_compressed_tmp))
-            else:
-                cmd = "tar --create --file {0} .".format(shlex.quote(dest_path_compressed_tmp))
+            output, on_warning = self.capture_output()
+            self.log_throttle()
+            if self.shards:
+                self.create_sharded(dest_name, on_warning, output)
+                return
 
-            report.log_command(cmd)
-            process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            # the archive is streamed to the storage, it becomes visible only on commit
+            writer = self.storage.open_write(dest_name)
+            try:
+                with metrics.span("archive") as span:
+                    if self.src_cmd is not None:
+                        stats, errors = self.throttle.run(self.create_from_cmd, writer, output)
+                    else:
+                        create_archive = functools.partial(archive.create_archive, seekable=self.seekable, snapshot=snap)
+                        stats, errors = self.throttle.run(create_archive, self.src_dir, writer, self.do_compress,
+                                                          self.compress_threads, self.compress_level, on_warning, self.throttle, self.checksum)
+                    writer.finish()
+                    span.add(bytes=stats.bytes_in, files=stats.files)
+            except Exception as err:
+                writer.abort()
+                raise BackupException("creating archive failed", base_exc=err)
 
-            processLimit = None
-            if self.cpu_limit:
-                limit_cmd = "cpulimit --lazy --include-children --pid={0} --limit={1}".format(process.pid, self.cpu_limit)
-                report.log_command(limit_cmd)
-                processLimit = subprocess.Popen(limit_cmd, shell=True)
-            else:
-                pass
+            report.log_state("Archived {0}".format(stats.format()))
+            self.log_throttle_waited()
 
-            r = process.wait()
-            if processLimit is not None:
-                processLimit.wait()
+            if errors and self.src_cmd is not None:
+                writer.abort()
+                raise BackupException("command failed with exit status {0}".format(errors), output.get())
+            if errors:
+                writer.abort()
+                raise BackupException("archive is incomplete, {0} files couldn't be read".format(errors), output.get())
+            self.log_output(output)
 
-            tar_output = process.stdout.read()
+            # archives of a chain always get a manifest, it lists the entries deleted since the parent
+            chain_info = {}
+            if state is not None:
+                chain_info = {'parent': parent, 'full': state.full if parent is not None else dest_name}
+                if parent is not None:
+                    chain_info['deleted'] = snap.get_deleted()
+                    report.log_msg("{0} entries deleted since {1}".format(len(chain_info['deleted']), parent))
 
-            if r == 0:
-                report.log_state("Moving {0} to {1}".format(self.cc(dest_path_compressed_tmp), self.cc(dest_path_compressed)))
-                os.rename(dest_path_compressed_tmp, dest_path_compressed)
-            else:
-                raise BackupException("tar failed", tar_output)
+            info = self.get_backup_info()
+            if parent is not None:
+                info = dict(info or {}, parent=parent)
+            save_state = None
+            if state is not None:
+                # saved before the archive is visible, a state naming an archive that never made it
+                # into the catalog only makes the next run create a full archive
+                def save_state():
+                    state.archive = dest_name
+                    state.full = chain_info['full']
+                    state.entries = snap.entries
+                    state.save()
+            self.store_archive(writer, dest_name, stats, info, before_commit=save_state, **chain_info)
         else:
             if os.path.exists(dest_path):
                 report.log_warn("Destination folder exists {0}".format(self.cc(dest_path)))
@@ -180,27 +397,402 @@ class BackupTask(Task):
             dest_path_tmp = dest_path + "_tmp"
             report.log_state("Copying {0} to {1}...".format(self.cc(self.src_dir), self.cc(dest_path_tmp)))
             try:
+                import shutil, copier
                 if os.path.exists(dest_path_tmp):
                     shutil.rmtree(dest_path_tmp)
-                shutil.copytree(self.src_dir, dest_path_tmp)
-                os.rename(dest_path_tmp, dest_path)
+
+                link_dest = None
+                if self.incremental:
+                    link_dest = self.find_link_dest()
+                    if link_dest is not None:
+                        report.log_state("Linking unchanged files to {0}".format(self.cc(link_dest)))
+
+                self.log_throttle()
+                with metrics.span("copy") as span:
+                    stats = self.throttle.run(copier.copy_tree, self.src_dir, dest_path_tmp, link_dest, self.copy_threads, self.throttle)
+                    span.add(bytes=stats.bytes, files=stats.files)
+                report.log_state("Copied {0}".format(stats.format()))
+                self.log_throttle_waited()
+
+                with metrics.span("rename"), self.storage.transaction() as cat:
+                    os.rename(dest_path_tmp, dest_path)
+                    cat.add(dest_file_name, kind='dir', info=self.get_backup_info())
             except Exception as err:
                 report.log_warn(err)
 
+    # writes the sidecars and makes the archive visible, a failed store leaves nothing behind;
+    # before_commit runs once the sidecars are written and can still fail the store
+    def store_archive(self, writer, dest_name, stats, info=None, before_commit=None, **manifest_info):
+        written = []
+        committed = False
+        try:
+            if stats.checksum or manifest_info:
+                import verify
+                if stats.checksum:
+                    report.log_msg("Checksum: {0}".format(stats.checksum))
+                self.storage.write_file(dest_name + verify.MANIFEST_EXTENSION,
+                                        verify.make_manifest(dest_name, stats.checksum, stats.bytes_out, files=stats.files, bytes_in=stats.bytes_in,
+                                                             created=self.ctx.base_date.strftime("%Y-%m-%d_%H%M%S"), **manifest_info))
+                written.append(dest_name + verify.MANIFEST_EXTENSION)
+            if stats.index is not None:
+                import archive
+                self.storage.write_file(dest_name + archive.INDEX_EXTENSION, stats.index)
+                written.append(dest_name + archive.INDEX_EXTENSION)
+            if before_commit is not None:
+                before_commit()
+
+            report.log_state("Storing {0}".format(self.cc(self.dest_dir + dest_name)))
+            with metrics.span("rename"), self.storage.transaction() as cat:
+                writer.commit()
+                committed = True
+                cat.add(dest_name, size=stats.bytes_out, checksum=stats.checksum, info=info)
+        except Exception:
+            writer.abort()
+            # a committed archive goes too, the next scan would find it without its sidecars
+            for name in ([dest_name] if committed else []) + written:
+                try:
+                    self.storage.delete(name)
+                except Exception as e:
+                    report.log_warn("Cannot remove {0}: {1}".format(self.cc(self.dest_dir + name), e))
+            raise
+
+    # returns the snapshot state, the snapshot to archive with and the parent archive, which is None for a full archive
+    def load_chain(self):
+        import snapshot
+        state = snapshot.State(self.storage, self.name, self.src_dir)
+        if not state.read():
+            report.log_msg("No snapshot of the source, creating a full archive")
+            return state, snapshot.Snapshot(), None
+
+        parent = self.storage.load_catalog(write=False).get(state.archive)
+        if parent is None or not is_usable(parent):
+            report.log_msg("Previous archive {0} is missing or corrupt, creating a full archive".format(state.archive))
+            return state, snapshot.Snapshot(), None
+        full_date = utils.get_date_from_filename(state.full)
+        if utils.get_date_diff_in_seconds(full_date, self.ctx.base_date) >= self.full_interval:
+            report.log_msg("Full archive {0} is older than full_interval, creating a full archive".format(state.full))
+            return state, snapshot.Snapshot(), None
+
+        report.log_msg("Creating an incremental archive on top of {0}".format(state.archive))
+        return state, snapshot.Snapshot(state.entries), state.archive
+
+    # stdout of the command goes straight to the compressor, stderr to the report; returns the stats and the exit status
+    def create_from_cmd(self, writer, output):
+        import subprocess, archive
+        process = subprocess.Popen(self.src_cmd, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        reader = procio.capture(process, output, pipe=process.stderr)
+        try:
+            stats = archive.create_stream(process.stdout, writer, self.do_compress, self.compress_threads, self.compress_level,
+                                          self.throttle, self.checksum)
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            reader.join()
+        return stats, returncode
+
+    def create_sharded(self, dest_name, on_warning, output):
+        import shutil, shards
+        dest_path = self.dest_dir + dest_name
+        dest_path_tmp = dest_path + "_tmp"
+        if os.path.exists(dest_path_tmp):
+            shutil.rmtree(dest_path_tmp)
+
+        try:
+            with metrics.span("archive") as span:
+                stats, errors, index = self.throttle.run(shards.create_sharded_archive, self.src_dir, dest_path_tmp, self.do_compress, self.shards,
+                                                         self.compress_threads, self.compress_level, on_warning, self.throttle, self.checksum,
+                                                         self.seekable)
+                span.add(bytes=stats.bytes_in, files=stats.files)
+        except Exception as err:
+            shutil.rmtree(dest_path_tmp, ignore_errors=True)
+            raise BackupException("creating archive failed", base_exc=err)
+
+        report.log_state("Archived {0} in {1} shards".format(stats.format(), len(index['shards'])))
+        self.log_throttle_waited()
+
+        if errors:
+            shutil.rmtree(dest_path_tmp, ignore_errors=True)
+            raise BackupException("archive is incomplete, {0} files couldn't be read".format(errors), output.get())
+        self.log_output(output)
+
+        report.log_state("Storing {0}".format(self.cc(dest_path)))
+        with metrics.span("rename"), self.storage.transaction() as cat:
+            os.rename(dest_path_tmp, dest_path)
+            cat.add(dest_name, size=stats.bytes_out, kind='sharded', info=self.get_backup_info())
+
+    def find_link_dest(self):
+        snapshots = [e for e in self.storage.load_catalog().sorted_entries() if e.kind == 'dir']
+        if not snapshots:
+            return None
+        return self.dest_dir + snapshots[-1].name
+
+# the source is read once and stored into several destinations, each with its own compress and
+# storage options; a failing destination doesn't stop the others
+class FanoutTask(Task):
+    targets = None
+    src_dir = None
+    throttle = None
+    output_tail_size = None
+
+    def __init__(self, config, ctx):
+        self.ctx = ctx
+        self.name = config['name']
+
+        base = {k: v for k, v in config.items() if k not in ('destinations', 'dest')}
+        if not config['destinations']:
+            raise BackupException("destinations is empty")
+        # the limits are shared by all destinations, they are applied by this task
+        for dest_config in config['destinations']:
+            options = sorted(k for k in dest_config if k in throttle.OPTIONS)
+            if options:
+                raise BackupException("{0}: {1} apply to all destinations, set them on the task".format(dest_config.get('dest'), ", ".join(options)))
+        target_base = {k: v for k, v in base.items() if k not in throttle.OPTIONS}
+        self.targets = [BackupTask(dict(target_base, **dest_config), ctx) for dest_config in config['destinations']]
+        for t in self.targets:
+            if t.src_cmd is not None or t.shards or t.incremental or t.do_compress not in ('gzip', 'store', 'zstd'):
+                raise BackupException("{0}: destinations take plain archives, src_cmd, shards, incremental and directory copies aren't supported".format(t.dest_dir))
+            if t.src_dir != self.targets[0].src_dir:
+                raise BackupException("all destinations have to use the same src")
+
+        self.src_dir = self.targets[0].src_dir
+        try:
+            self.throttle = throttle.from_config(base)
+        except ValueError as e:
+            raise BackupException(str(e))
+        if self.throttle.cpu is not None and not any(t.do_compress in throttle.CPU_LIMITED_COMPRESS for t in self.targets):
+            raise BackupException("cpu_limit limits compression, no destination is compressed")
+        self.output_tail_size = base.get('output_tail_size', procio.DEFAULT_TAIL_SIZE)
+
+    def get_next_due(self):
+        dues = [t.get_next_due() for t in self.targets]
+        if None in dues:
+            return None
+        return min(dues)
+
+    # an unreachable destination fails alone, the others are still backed up
+    def perform(self):
+        targets = []
+        failed = []
+        for t in self.targets:
+            report.log_msg("Destination {0}".format(t.dest_dir))
+            try:
+                if t.check_if_needed():
+                    targets.append(t)
+            except Exception as e:
+                report.log_warn("{0}: {1}".format(t.dest_dir, e))
+                failed.append(t.dest_dir)
+        total = len(targets) + len(failed)
+
+        if targets:
+            self.create_archives(targets, failed)
+        if failed:
+            raise BackupException("{0} of {1} destinations failed: {2}".format(len(failed), total, ", ".join(failed)))
+
+    def create_archives(self, targets, failed):
+        dest_file_name = self.ctx.base_date.strftime("%Y-%m-%d_%H%M%S_") + utils.get_valid_filename(self.name)
+
+        if self.ctx.dry_run:
+            for t in targets:
+                report.log_msg("Dry run, would create backup {0} in {1}".format(dest_file_name, t.dest_dir))
+            return
+
+        import archive
+
+        rpl = [
+            ['DEST_FILENAME', dest_file_name],
+            ['SRC_DIR', self.src_dir],
+        ]
+        self.process_vars(rpl)
+
+        jobs = []
+        for t in targets:
+            t.set_vars(rpl + [['DEST_DIR', t.dest_dir]])
+            dest_name = dest_file_name + "." + archive.COMPRESS_EXTENSIONS[t.do_compress]
+            try:
+                if t.storage.exists(dest_name):
+                    report.log_warn("Destination file exists {0}".format(t.cc(t.dest_dir + dest_name)))
+                    continue
+                report.log_state("Creating archive {0} to {1}...".format(t.cc(self.src_dir), t.cc(t.dest_dir + dest_name)))
+                writer = t.storage.open_write(dest_name)
+            except Exception as e:
+                report.log_warn("{0}: {1}".format(t.dest_dir, e))
+                failed.append(t.dest_dir)
+                continue
+            sink = archive.FanoutSink(writer, t.do_compress, t.compress_threads, t.compress_level, self.throttle, t.checksum, t.seekable)
+            jobs.append((t, dest_name, writer, sink))
+        if not jobs:
+            return
+
+        output, on_warning = self.capture_output()
+        self.log_throttle()
+        try:
+            with metrics.span("archive") as span:
+                stats, errors = self.throttle.run(archive.create_fanout, self.src_dir, [job[3] for job in jobs], on_warning, self.throttle)
+                span.add(bytes=stats.bytes_in, files=stats.files)
+        except Exception as err:
+            for job in jobs:
+                job[2].abort()
+            raise BackupException("creating archive failed", base_exc=err)
+        self.log_throttle_waited()
+
+        if errors:
+            for job in jobs:
+                job[2].abort()
+            raise BackupException("archive is incomplete, {0} files couldn't be read".format(errors), output.get())
+        self.log_output(output)
+
+        for t, dest_name, writer, sink in jobs:
+            try:
+                if sink.error is not None:
+                    raise sink.error
+                writer.finish()
+                report.log_state("Archived {0} to {1}".format(sink.stats.format(), t.dest_dir))
+                t.store_archive(writer, dest_name, sink.stats, t.get_backup_info())
+            except Exception as e:
+                writer.abort()
+                report.log_warn("{0}: storing failed: {1}".format(t.dest_dir, e))
+                failed.append(t.dest_dir)
+
+def make_backup_task(config, ctx):
+    if 'destinations' in config:
+        return FanoutTask(config, ctx)
+    return BackupTask(config, ctx)
+
+def format_date(date):
+    return date.strftime("%Y-%m-%d_%H%M%S")
+
+def is_usable(entry):
+    return not (entry.info and entry.info.get('corrupt'))
+
+def verify_entries(dest_dir, entries, processes=None, read_limit=None):
+    import verify
+    files = []
+    size = 0
+    backups = {}
+    for e in entries:
+        path = dest_dir + e.name
+        if e.kind == 'sharded':
+            shard_files = get_shard_files(e.name, path)
+        else:
+            checksum = verify.get_checksum(path, e.checksum)
+            shard_files = [(e.name, path, checksum)] if checksum is not None else None
+        if shard_files is None:
+            report.log_msg("{0}: no checksum, skipped".format(e.name))
+            continue
+        files.extend(shard_files)
+        backups.update((f[0], e.name) for f in shard_files)
+        size += e.size or 0
+
+    results = {}
+    if not files:
+        return results
+
+    report.log_state("Verifying {0} backups ({1})...".format(len(set(backups.values())), utils.format_size(size)))
+    with metrics.span("verify") as span:
+        for name, error in verify.verify_files(files, processes, read_limit):
+            if error is None:
+                report.log_state("{0}: OK".format(name))
+            else:
+                report.log_warn("{0}: corrupt, {1}".format(name, error))
+            # a backup is corrupt when any of its shards is
+            backup = backups[name]
+            if results.get(backup) is None:
+                results[backup] = error if error is None or name == backup else "{0}: {1}".format(name[len(backup) + 1:], error)
+        span.add(bytes=size, files=len(files))
+    return results
+
+def get_shard_files(name, path):
+    import shards
+    index = shards.read_index(path)
+    if index is None or not all(s['checksum'] for s in index['shards']):
+        return None
+    return [(name + "/" + s['name'], os.path.join(path, s['name']), s['checksum']) for s in index['shards']]
+
+def record_verification(cat, results, date):
+    for name, error in results.items():
+        cat.update_info(name, verified=format_date(date), corrupt=error)
+
+class VerifyTask(Task):
+    processes = None
+    read_limit = None
+    verify_interval = None
+
+    def __init__(self, config, ctx):
+        super().__init__(config, ctx)
+
+        self.processes = config.get('processes')
+        self.read_limit = utils.get_size_from_str(config.get('read_limit'))
+        self.verify_interval = utils.get_interval_from_str(config.get('verify_interval'))
+
+        if not self.storage.is_local:
+            raise BackupException("Verification needs a local destination: {0}".format(self.dest_dir))
+
+    def needs_verify(self, entry):
+        if entry.kind not in ARCHIVE_KINDS or not is_usable(entry):
+            return False
+        verified = entry.info.get('verified') if entry.info else None
+        if verified is None:
+            return True
+        if not self.verify_interval:
+            return False
+        return (self.ctx.base_date - utils.get_date_from_filename(verified)).total_seconds() >= self.verify_interval
+
+    def perform(self):
+        cat = self.storage.load_catalog(write=not self.ctx.dry_run)
+        entries = [e for e in cat.sorted_entries() if self.needs_verify(e)]
+        if not entries:
+            report.log_msg("Nothing to verify")
+            return
+
+        if self.ctx.dry_run:
+            for entry in entries:
+                report.log_state("Would verify {0}".format(entry.name))
+            return
+
+        results = verify_entries(self.dest_dir, entries, self.processes, self.read_limit)
+        with self.storage.transaction() as cat:
+            record_verification(cat, results, self.ctx.base_date)
+
+        corrupt = sorted(name for name, error in results.items() if error is not None)
+        if corrupt:
+            raise BackupException("{0} corrupt backups: {1}".format(len(corrupt), ", ".join(corrupt)))
+
 class RotateTask(Task):
     delete_older_than = None 
     clean_day_parts = None
+    retention = None
     delete_prefix = None
+    purge_threads = None
+    verify = None
+    verify_processes = None
+    verify_read_limit = None
 
-    def __init__(self, config):
-        super().__init__(config)
+    def __init__(self, config, ctx):
+        super().__init__(config, ctx)
 
         self.delete_older_than = config.get('delete_older_than')
         self.clean_day_parts = config.get('clean_day_parts')
+        self.retention = config.get('retention')
         self.delete_prefix = config.get('delete_prefix')
+        self.purge_threads = config.get('purge_threads', trash.DEFAULT_THREADS)
+        self.verify = config.get('verify', False)
+        self.verify_processes = config.get('verify_processes')
+        self.verify_read_limit = utils.get_size_from_str(config.get('verify_read_limit'))
+
+        if self.verify and not self.storage.is_local:
+            raise BackupException("Verification needs a local destination: {0}".format(self.dest_dir))
 
-        if self.delete_older_than is not None and self.clean_day_parts is not None:
-            raise BackupException.log_error("specify one of delete_older_than or clean_day_parts")
+        if sum(x is not None for x in (self.delete_older_than, self.clean_day_parts, self.retention)) > 1:
+            raise BackupException("specify one of delete_older_than, clean_day_parts or retention")
+
+        if self.retention is not None:
+            try:
+                self.retention = planner.parse_retention(self.retention)
+            except (ValueError, TypeError, AttributeError) as e:
+                raise BackupException("Invalid retention: {0}".format(e))
 
     def perform(self):
         self.rpl = [
@@ -208,106 +800,298 @@ class RotateTask(Task):
         ]
         self.rpl = sorted(self.rpl, key=lambda x: -len(x[1]))
 
-        if self.delete_older_than is not None:
-            interval = utils.get_interval_from_str(self.delete_older_than)
+        if self.ctx.dry_run:
+            plan = self.make_plan(self.storage.load_catalog(write=False))
+            for entry in plan.delete:
+                report.log_state("Would delete {0}".format(self.cc(entry.name)))
+            return
 
-            for filename in os.listdir(self.dest_dir):
-                if filename.endswith(".tmp"):
-                    continue
-                date = utils.get_date_from_filename(filename)
-                if date is None:
-                    continue
+        with self.storage.transaction() as cat:
+            if self.verify:
+                self.verify_keepers(cat)
 
-                if utils.get_date_diff_in_seconds(date, base_date) >= interval:
-                    self.delete_backup_file(filename)
-
-        elif self.clean_day_parts:
-            parts = []
-            # extract parts from string
-            cur_date = base_date.date()
-            for p in self.clean_day_parts.split(","):
-                days = int(p.strip())
-                start_date = cur_date - timedelta(days - 1)
-                end_date = cur_date
-                cur_date = start_date - timedelta(1)
-                parts.append({"from": start_date, "to": end_date, "file_to_keep": None})
-
-            # assign files to parts
-            for filename in os.listdir(self.dest_dir):
-                if filename.endswith(".tmp"):
-                    continue
-                date = utils.get_date_from_filename(filename)
-                if date is None:
-                    continue
-                date = date.date()
+            with metrics.span("plan") as span:
+                plan = self.make_plan(cat)
+                span.add(files=len(cat.entries))
 
-                for p in parts:
-                    if date >= p["from"] and date <= p["to"]:
-                        if p["file_to_keep"] is None or utils.get_date_from_filename(p["file_to_keep"]).date() > date:
-                            p["file_to_keep"] = filename
+            with metrics.span("delete") as span:
+                for entry in plan.delete:
+                    self.delete_backup_file(entry.name)
+                    cat.remove(entry.name)
+                span.add(files=len(plan.delete))
 
-            # gather all files to keep
-            report.log_msg("Current backups state")
-            files_to_keep = []
-            for p in parts:
-                if p["file_to_keep"] is not None:
-                    files_to_keep.append(p["file_to_keep"])
+        self.storage.purge(self.purge_threads)
 
-                    file_date = utils.get_date_from_filename(p["file_to_keep"])
-                    file_str = "{0[file_to_keep]} ({1})".format(p, ago_format(base_date - file_date))
-                else:
-                    file_str = 'no file'
+    def get_plan(self, cat):
+        return planner.plan_rotation(cat.sorted_entries(), self.ctx.base_date, delete_older_than=self.delete_older_than,
+                                     clean_day_parts=self.clean_day_parts, is_usable=is_usable, retention=self.retention,
+                                     get_parent=self.get_parent)
 
-                report.log_state("[{0[from]}, {0[to]}] file: {1}".format(p, file_str))
+    # the parent is recorded in the catalog, with a rebuilt catalog it is read from the manifest
+    def get_parent(self, entry):
+        if entry.info and 'parent' in entry.info:
+            return entry.info['parent']
+        import snapshot
+        if not snapshot.is_incremental_name(entry.name) or not self.storage.is_local:
+            return None
+        import verify
+        manifest = verify.read_manifest(self.dest_dir + entry.name)
+        return manifest.get('parent') if manifest else None
 
-            for filename in os.listdir(self.dest_dir):
-                if filename.endswith(".tmp"):
-                    continue
-                date = utils.get_date_from_filename(filename)
-                if date is None:
-                    continue
-                date = date.date()
+    def make_plan(self, cat):
+        plan = self.get_plan(cat)
+        self.log_plan(plan)
+        return plan
+
+    # a backup becomes the only copy of its part once the others are deleted, so it is
+    # verified first, even when an earlier run verified it; a corrupt one is replaced by
+    # the next backup of the part
+    def verify_keepers(self, cat):
+        checked = set()
+        while True:
+            plan = self.get_plan(cat)
+            keepers = [p.file_to_keep for p in plan.parts
+                       if p.file_to_keep is not None and p.file_to_keep.kind in ARCHIVE_KINDS and p.file_to_keep.name not in checked
+                       and self.needs_verify(p, plan.delete)]
+            if not keepers:
+                return
+            checked.update(e.name for e in keepers)
+            record_verification(cat, verify_entries(self.dest_dir, keepers, self.verify_processes, self.verify_read_limit), self.ctx.base_date)
+
+    def needs_verify(self, part, delete):
+        if not (part.file_to_keep.info and part.file_to_keep.info.get('verified')):
+            return True
+        return any(planner.is_in_part(part, e.date) for e in delete)
+
+    def log_plan(self, plan):
+        if not plan.parts:
+            return
+
+        report.log_msg("Current backups state")
+        for p in plan.parts:
+            if p.file_to_keep is not None:
+                file_str = "{0} ({1})".format(p.file_to_keep.name, ago_format(self.ctx.base_date - p.file_to_keep.date))
+            else:
+                file_str = 'no file'
 
-                if not filename in files_to_keep:
-                    self.delete_backup_file(filename)
+            report.log_state("[{0}, {1}] file: {2}".format(p.date_from, p.date_to, file_str))
 
     def delete_backup_file(self, filename):
         if self.delete_prefix:
             new_filename = self.delete_prefix + filename
             report.log_state("Renaming {0} to {1}...".format(self.cc(filename), self.cc(new_filename)))
-            dest_path = self.dest_dir + filename
-            new_dest_path = self.dest_dir + new_filename
-            os.rename(dest_path, new_dest_path)
+            for name in [filename] + self.get_sidecars(filename):
+                self.storage.rename(name, self.delete_prefix + name)
         else:
             report.log_state("Deleting {0}...".format(self.cc(filename)))
-            dest_path = self.dest_dir + filename
-            if os.path.isfile(dest_path):
-                os.remove(dest_path)
-            elif os.path.isdir(dest_path):
-                shutil.rmtree(dest_path)
+            for name in [filename] + self.get_sidecars(filename):
+                self.storage.delete(name)
 
-if __name__ == "__main__":
-    for task in config['tasks']:
+    def get_sidecars(self, filename):
+        return [filename + ext for ext in utils.sidecar_extensions if self.storage.exists(filename + ext)]
+
+def get_task_dests(task_config):
+    dests = [d.get('dest') for d in task_config.get('destinations') or []]
+    if not dests:
+        dests = [task_config.get('dest')]
+    return [dest.rstrip("/") + "/" for dest in dests if dest is not None]
+
+def run_task(task_config, section, ctx):
+    with report.use_section(section), metrics.task("{0} {1}".format(task_config.get('task'), task_config.get('name'))):
         try:
-            type = task['task']
+            type = task_config['task']
             if type == "backup":
-                t = BackupTask(task)
+                t = make_backup_task(task_config, ctx)
                 report.log_task("Backup {0}".format(t.name))
             elif type == "rotate":
-                t = RotateTask(task)
+                t = RotateTask(task_config, ctx)
                 report.log_task("Rotate {0}".format(t.name))
+            elif type == "verify":
+                t = VerifyTask(task_config, ctx)
+                report.log_task("Verify {0}".format(t.name))
             t.perform()
-            code = 0
+            return 0
         except BackupException as e:
             e.log()
-            code = 1
+            return 1
         except Exception as e:
             e = BackupException("task failed", base_exc=e)
             e.log()
-            code = 1
+            return 1
+
+def run_config(config, ctx=None, mailer=None):
+    ctx = (ctx or Context()).for_run()
+
+    report.init()
+    metrics.init()
+    report.log_name(config['name'])
+
+    max_workers = ctx.jobs or config.get('concurrency', 1)
+
+    sched = scheduler.Scheduler(max_workers)
+    sections = []
+    jobs = []
+    for task_config in config['tasks']:
+        section = report.Section(task_config.get('name') if max_workers > 1 else None)
+        sections.append(section)
+        job = sched.add(functools.partial(run_task, task_config, section, ctx), get_task_dests(task_config))
+        jobs.append((task_config.get('task'), job))
+
+    # rotation on a destination runs after all backups into it
+    for type, job in jobs:
+        if type == "rotate":
+            job.after = [other for other_type, other in jobs if other_type == "backup" and other.dests & job.dests]
+
+    codes = sched.run()
+    trash.wait()
+    for section in sections:
+        report.add_section(section)
+    code = max(codes, default=0)
+    report.log_timings(metrics.get_totals())
 
     mail_config = config.get('mail')
     if mail_config:
-        report.send(config, code)
-    exit(code)
+        report.send(config, code, mailer)
+
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('json'):
+        metrics.write_json(metrics_config['json'], config['name'], code)
+    if metrics_config.get('prometheus'):
+        metrics.write_prometheus(metrics_config['prometheus'], config['name'], code)
+    return code
+
+def get_next_due(config, ctx):
+    due = None
+    has_backups = False
+    for task_config in config['tasks']:
+        if task_config.get('task') != "backup":
+            continue
+        has_backups = True
+        task_due = make_backup_task(task_config, ctx).get_next_due()
+        if task_due is None:
+            return datetime.now()
+        if due is None or task_due < due:
+            due = task_due
+    if not has_backups:
+        return datetime.now() + timedelta(seconds=ROTATE_ONLY_INTERVAL)
+    return due
+
+class DaemonConfig:
+    path = None
+    ctx = None
+    retry_delay = None
+    mtime = None
+    config = None
+    next_due = None
+
+    def __init__(self, path, ctx, retry_delay):
+        self.path = path
+        self.ctx = ctx
+        self.retry_delay = retry_delay
 
+    def load(self, mtime):
+        self.mtime = mtime
+        self.config = None
+        try:
+            config = load_config(self.path)
+            self.next_due = get_next_due(config, self.ctx)
+            self.config = config
+            sys.stderr.write("{0}: loaded, next run at {1}\n".format(self.path, self.next_due.strftime("%Y-%m-%d %H:%M:%S")))
+        except Exception as e:
+            sys.stderr.write("{0}: invalid config, ignored until it changes: {1}\n".format(self.path, e))
+
+    def run(self, mailer):
+        code = run_config(self.config, self.ctx, mailer)
+        try:
+            self.next_due = get_next_due(self.config, self.ctx)
+        except Exception as e:
+            sys.stderr.write("{0}: {1}\n".format(self.path, e))
+            code = 1
+        if code != 0:
+            # a failed backup is still due, don't retry it in a loop
+            retry = datetime.now() + timedelta(seconds=self.retry_delay)
+            if self.next_due is None or self.next_due < retry:
+                self.next_due = retry
+        sys.stderr.write("{0}: finished with code {1}, next run at {2}\n".format(self.path, code, self.next_due.strftime("%Y-%m-%d %H:%M:%S")))
+
+def scan_config_dir(config_dir, configs, ctx, retry_delay):
+    found = {}
+    with os.scandir(config_dir) as it:
+        for e in it:
+            if e.name.startswith(".") or not e.name.endswith(CONFIG_EXTENSIONS) or not e.is_file():
+                continue
+            found[e.path] = e.stat().st_mtime_ns
+
+    for path in list(configs):
+        if path not in found:
+            sys.stderr.write("{0}: removed\n".format(path))
+            del configs[path]
+    for path, mtime in sorted(found.items()):
+        if path not in configs:
+            configs[path] = DaemonConfig(path, ctx, retry_delay)
+        if configs[path].mtime != mtime:
+            configs[path].load(mtime)
+
+def run_daemon(config_dir, ctx=None, poll=DEFAULT_POLL, retry_delay=DEFAULT_RETRY_DELAY):
+    import signal
+    ctx = ctx or Context()
+    retry_delay = utils.get_interval_from_str(retry_delay)
+    configs = {}
+    mailer = report.Mailer()
+    wakeup = threading.Event()
+    stopped = []
+
+    def stop(signum, frame):
+        stopped.append(signum)
+        wakeup.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, lambda signum, frame: wakeup.set())
+
+    try:
+        while not stopped:
+            scan_config_dir(config_dir, configs, ctx, retry_delay)
+
+            for c in sorted(configs.values(), key=lambda c: c.path):
+                if stopped:
+                    break
+                if c.config is not None and c.next_due <= datetime.now():
+                    c.run(mailer)
+
+            next_wakeup = datetime.now() + timedelta(seconds=poll)
+            for c in configs.values():
+                if c.config is not None and c.next_due < next_wakeup:
+                    next_wakeup = c.next_due
+
+            wakeup.wait(max(0, (next_wakeup - datetime.now()).total_seconds()))
+            wakeup.clear()
+    finally:
+        mailer.close()
+        trash.wait()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--config")
+    mode.add_argument("--daemon", metavar="CONFIG_DIR", help="keep running and perform backups of all configs in the directory when they are due")
+    parser.add_argument("--force", action='store_true')
+    parser.add_argument("--basedate", help="YYYY-MM-DD or YYYY-MM-DD_HHMMSS")
+    parser.add_argument("--dry-run", action='store_true')
+    parser.add_argument("--jobs", type=int)
+    parser.add_argument("--poll", type=int, default=DEFAULT_POLL, help="daemon: seconds between checks of the config directory")
+    parser.add_argument("--retry-delay", default=DEFAULT_RETRY_DELAY, help="daemon: delay before a failed config is run again")
+    args = parser.parse_args(argv)
+
+    base_date = None
+    if args.basedate:
+        base_date = utils.get_date_from_filename(args.basedate) or datetime.strptime(args.basedate, "%Y-%m-%d")
+    ctx = Context(base_date, force=args.force, dry_run=args.dry_run, jobs=args.jobs)
+
+    if args.daemon:
+        run_daemon(args.daemon, ctx, poll=args.poll, retry_delay=args.retry_delay)
+        return 0
+    return run_config(load_config(args.config), ctx)
+
+if __name__ == "__main__":
+    sys.exit(main())
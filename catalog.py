@@ -0,0 +1,173 @@
+import os, json, time, fcntl, contextlib
+from collections import namedtuple
+import utils
+
+STATE_DIR = ".backups-rotate"
+CATALOG_FILE = "catalog.json"
+LOCK_FILE = "lock"
+VERSION = 1
+
+# directory mtime closer than this to the save time can't be trusted,
+# a later change could have happened within the same timestamp granularity
+RACY_WINDOW = 2
+
+Entry = namedtuple('Entry', ['name', 'date', 'size', 'kind', 'checksum', 'info'], defaults=(None, None, None, None))
+
+def entry_sort_key(entry):
+    return (entry.date, entry.name)
+
+def get_state_dir(dest_dir):
+    return os.path.join(dest_dir, STATE_DIR)
+
+def get_entry_kind(dir_entry):
+    if dir_entry.is_dir(follow_symlinks=False):
+        return 'sharded' if dir_entry.name.endswith(utils.sharded_extension) else 'dir'
+    return 'file'
+
+class Catalog:
+    dest_dir = None
+    path = None
+
+    entries = None
+    latest = None
+    dir_mtime_ns = None
+    saved_at = None
+
+    def __init__(self, dest_dir):
+        self.dest_dir = dest_dir
+        self.path = os.path.join(get_state_dir(dest_dir), CATALOG_FILE)
+        self.entries = {}
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if not self.load_data(data):
+                return False
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        return self.is_valid()
+
+    def load_data(self, data):
+        if data['version'] != VERSION:
+            return False
+
+        for name, size, kind, checksum, info in data['entries']:
+            self.entries[name] = Entry(name, utils.get_date_from_filename(name), size, kind, checksum, info)
+        self.latest = self.entries.get(data['latest'])
+        self.dir_mtime_ns = data['dir_mtime_ns']
+        self.saved_at = data['saved_at']
+        return True
+
+    def dump_data(self):
+        return {
+            'version': VERSION,
+            'dir_mtime_ns': self.dir_mtime_ns,
+            'saved_at': self.saved_at,
+            'latest': self.latest.name if self.latest is not None else None,
+            'entries': [[e.name, e.size, e.kind, e.checksum, e.info] for e in self.sorted_entries()],
+        }
+
+    def is_valid(self):
+        if self.dir_mtime_ns >= (self.saved_at - RACY_WINDOW) * 10**9:
+            return False
+        return os.stat(self.dest_dir).st_mtime_ns == self.dir_mtime_ns
+
+    def scan(self):
+        old_entries = self.entries
+        self.entries = {}
+        self.latest = None
+
+        with os.scandir(self.dest_dir) as it:
+            for e in it:
+                if utils.is_tmp_filename(e.name) or utils.is_sidecar_filename(e.name):
+                    continue
+                date = utils.get_date_from_filename(e.name)
+                if date is None:
+                    continue
+
+                kind = get_entry_kind(e)
+                old = old_entries.get(e.name)
+                if old is not None and old.kind == kind:
+                    self.put(old)
+                elif kind == 'file':
+                    self.put(Entry(e.name, date, e.stat(follow_symlinks=False).st_size, kind))
+                else:
+                    self.put(Entry(e.name, date, None, kind))
+
+    def save(self):
+        os.makedirs(get_state_dir(self.dest_dir), exist_ok=True)
+
+        self.dir_mtime_ns = os.stat(self.dest_dir).st_mtime_ns
+        self.saved_at = time.time()
+        data = self.dump_data()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def put(self, entry):
+        self.entries[entry.name] = entry
+        if self.latest is None or entry_sort_key(self.latest) < entry_sort_key(entry):
+            self.latest = entry
+
+    def add(self, name, size=None, kind='file', checksum=None, info=None):
+        self.put(Entry(name, utils.get_date_from_filename(name), size, kind, checksum, info))
+
+    def update_info(self, name, **info):
+        entry = self.entries.get(name)
+        if entry is None:
+            return
+        new_info = dict(entry.info or {})
+        new_info.update(info)
+        self.put(entry._replace(info=new_info))
+
+    def remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None and entry is self.latest:
+            self.latest = max(self.entries.values(), key=entry_sort_key, default=None)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def sorted_entries(self):
+        return sorted(self.entries.values(), key=entry_sort_key)
+
+    def last_date(self):
+        if self.latest is None:
+            return None
+        return self.latest.date
+
+@contextlib.contextmanager
+def lock(dest_dir):
+    os.makedirs(get_state_dir(dest_dir), exist_ok=True)
+    with open(os.path.join(get_state_dir(dest_dir), LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def load(dest_dir, write=True):
+    cat = Catalog(dest_dir)
+    if not cat.read():
+        if write:
+            with lock(dest_dir):
+                cat.scan()
+                cat.save()
+        else:
+            cat.scan()
+    return cat
+
+@contextlib.contextmanager
+def transaction(dest_dir):
+    with lock(dest_dir):
+        cat = Catalog(dest_dir)
+        if not cat.read():
+            cat.scan()
+        yield cat
+        cat.save()
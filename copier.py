@@ -0,0 +1,221 @@
+import os, stat, shutil, time, errno, threading, fcntl, concurrent.futures
+import report, utils
+
+FICLONE = 0x40049409
+COPY_CHUNK = 64 * 1024 * 1024
+THROTTLED_CHUNK = 1024 * 1024
+DEFAULT_THREADS = 16
+
+# errors meaning "this copy method is not available here", the next one is tried
+UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.ENOTSUP)
+
+class Stats:
+    files = 0
+    copied = 0
+    reflinked = 0
+    linked = 0
+    dirs = 0
+    bytes = 0
+    started = None
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, **counters):
+        with self.lock:
+            for k, v in counters.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def format(self):
+        elapsed = max(self.elapsed(), 0.001)
+        return "{0} files ({1} copied, {2} reflinked, {3} linked), {4} dirs, {5} in {6:.1f}s ({7}/s, {8:.0f} files/s)".format(
+            self.files, self.copied, self.reflinked, self.linked, self.dirs, utils.format_size(self.bytes), elapsed,
+            utils.format_size(self.bytes / elapsed), self.files / elapsed)
+
+# ownership is compared only when copies keep it, otherwise every copy is owned by us
+def is_unchanged(st, prev_path, owner=True):
+    try:
+        prev = os.lstat(prev_path)
+    except OSError:
+        return False
+    return (stat.S_ISREG(prev.st_mode) and
+            prev.st_size == st.st_size and
+            prev.st_mtime_ns == st.st_mtime_ns and
+            prev.st_mode == st.st_mode and
+            (not owner or (prev.st_uid == st.st_uid and prev.st_gid == st.st_gid)))
+
+class TreeCopier:
+    def __init__(self, link_dest=None, threads=None, on_warning=report.log_warn, throttle=None):
+        self.link_dest = link_dest
+        self.throttle = throttle
+        self.threads = threads or DEFAULT_THREADS
+        # warnings also come from the worker threads
+        self.on_warning = report.bind_section(on_warning)
+        self.stats = Stats()
+        self.use_reflink = True
+        self.use_copy_file_range = hasattr(os, "copy_file_range")
+        self.use_sendfile = True
+        # only root can give the copies the owners of the source
+        self.preserve_owner = os.geteuid() == 0
+
+    def copy_data(self, src_fd, dst_fd, size):
+        if self.use_reflink:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return True
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                self.use_reflink = False
+
+        # limited copies go in small chunks, each one paid for before it is copied
+        chunk_size = COPY_CHUNK if self.throttle is None else THROTTLED_CHUNK
+        offset = 0
+        if self.use_copy_file_range:
+            try:
+                while offset < size:
+                    self.consume(min(chunk_size, size - offset))
+                    n = os.copy_file_range(src_fd, dst_fd, min(chunk_size, size - offset))
+                    if n == 0:
+                        break
+                    offset += n
+                return False
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS or offset > 0:
+                    raise
+                self.use_copy_file_range = False
+
+        if self.use_sendfile:
+            try:
+                while offset < size:
+                    self.consume(min(chunk_size, size - offset))
+                    n = os.sendfile(dst_fd, src_fd, offset, min(chunk_size, size - offset))
+                    if n == 0:
+                        break
+                    offset += n
+                return False
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS or offset > 0:
+                    raise
+                self.use_sendfile = False
+
+        while True:
+            buf = os.read(src_fd, 1024 * 1024)
+            if not buf:
+                break
+            self.consume(len(buf))
+            os.write(dst_fd, buf)
+        return False
+
+    def consume(self, n):
+        if self.throttle is not None:
+            self.throttle.consume_read(n)
+            self.throttle.consume_write(n)
+
+    # chown clears setuid bits, it goes before the mode is copied
+    def copy_owner(self, dst, st):
+        if self.preserve_owner:
+            os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+
+    def copy_file(self, src, dst, relpath, st):
+        if self.link_dest is not None:
+            prev = os.path.join(self.link_dest, relpath)
+            if is_unchanged(st, prev, self.preserve_owner):
+                try:
+                    os.link(prev, dst)
+                    self.stats.add(files=1, linked=1)
+                    return
+                except OSError as e:
+                    if e.errno != errno.EMLINK:
+                        raise
+
+        try:
+            src_fd = os.open(src, os.O_RDONLY | os.O_NOFOLLOW)
+        except FileNotFoundError:
+            self.on_warning("{0}: File removed before we read it".format(relpath))
+            return
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                reflinked = self.copy_data(src_fd, dst_fd, st.st_size)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        self.copy_owner(dst, st)
+        shutil.copystat(src, dst, follow_symlinks=False)
+
+        if reflinked:
+            self.stats.add(files=1, reflinked=1, bytes=st.st_size)
+        else:
+            self.stats.add(files=1, copied=1, bytes=st.st_size)
+
+    def copy_tree(self, src_dir, dst_dir):
+        os.mkdir(dst_dir)
+        self.stats.add(dirs=1)
+        # directory times are restored last, copying files into them changes them
+        dirs = [(src_dir, dst_dir, os.stat(src_dir))]
+
+        # the walk stays ahead of the copy workers only by a bounded number of files
+        slots = threading.BoundedSemaphore(self.threads * 64)
+        errors = []
+
+        def done(future):
+            slots.release()
+            if future.exception() is not None:
+                errors.append(future.exception())
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as pool:
+            stack = [""]
+            while stack and not errors:
+                reldir = stack.pop()
+                with os.scandir(os.path.join(src_dir, reldir)) as it:
+                    entries = list(it)
+
+                files = []
+                subdirs = 0
+                for e in entries:
+                    relpath = os.path.join(reldir, e.name)
+                    dst = os.path.join(dst_dir, relpath)
+                    try:
+                        st = e.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        self.on_warning("{0}: File removed before we read it".format(relpath))
+                        continue
+
+                    if stat.S_ISDIR(st.st_mode):
+                        os.mkdir(dst)
+                        subdirs += 1
+                        dirs.append((e.path, dst, st))
+                        stack.append(relpath)
+                    elif stat.S_ISLNK(st.st_mode):
+                        os.symlink(os.readlink(e.path), dst)
+                        self.copy_owner(dst, st)
+                        shutil.copystat(e.path, dst, follow_symlinks=False)
+                        self.stats.add(files=1)
+                    elif stat.S_ISREG(st.st_mode):
+                        files.append((e.path, dst, relpath, st))
+                    else:
+                        self.on_warning("{0}: special file ignored".format(relpath))
+
+                # subdirectories of this directory are created before its files are handed out
+                self.stats.add(dirs=subdirs)
+                for args in files:
+                    slots.acquire()
+                    pool.submit(self.copy_file, *args).add_done_callback(done)
+
+        if errors:
+            raise errors[0]
+
+        for src, dst, st in reversed(dirs):
+            self.copy_owner(dst, st)
+            shutil.copystat(src, dst)
+
+        return self.stats
+
+def copy_tree(src_dir, dst_dir, link_dest=None, threads=None, throttle=None):
+    return TreeCopier(link_dest=link_dest, threads=threads, throttle=throttle).copy_tree(src_dir, dst_dir)
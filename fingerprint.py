@@ -0,0 +1,125 @@
+import os, json, stat, time, hashlib, concurrent.futures
+import catalog, report, utils
+
+CACHE_PREFIX = "fingerprint_"
+VERSION = 1
+DEFAULT_THREADS = 16
+
+def get_cache_name(name):
+    return CACHE_PREFIX + utils.get_valid_filename(name) + ".json"
+
+# kept with the other state of the destination, the storage decides where
+class Cache:
+    storage = None
+    name = None
+    src_dir = None
+    dirs = None
+    checked_at = None
+
+    def __init__(self, storage, name, src_dir):
+        self.storage = storage
+        self.name = get_cache_name(name)
+        self.src_dir = src_dir
+        self.dirs = {}
+
+    def read(self):
+        try:
+            data = self.storage.read_state(self.name)
+            if data is None:
+                return False
+            data = json.loads(data)
+            if data['version'] != VERSION or data['src'] != self.src_dir:
+                return False
+            self.dirs = data['dirs']
+            self.checked_at = utils.get_date_from_filename(data['checked_at']) if data['checked_at'] else None
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def save(self):
+        data = {
+            'version': VERSION,
+            'src': self.src_dir,
+            'checked_at': self.checked_at.strftime("%Y-%m-%d_%H%M%S") if self.checked_at else None,
+            'dirs': self.dirs,
+        }
+        self.storage.write_state(self.name, json.dumps(data).encode())
+
+def encode(txt):
+    return txt.encode("utf-8", "surrogateescape")
+
+class Fingerprinter:
+    src_dir = None
+    cache = None
+    trust_dir_mtime = None
+    threads = None
+    started = None
+
+    def __init__(self, src_dir, cache=None, trust_dir_mtime=False, threads=None, on_warning=report.log_warn):
+        self.src_dir = src_dir
+        self.cache = cache if cache is not None else {}
+        self.trust_dir_mtime = trust_dir_mtime
+        self.threads = threads or DEFAULT_THREADS
+        self.on_warning = report.bind_section(on_warning)
+        self.files = 0
+
+    # returns [dir mtime, hash of the directory's own entries, subdirectory names]
+    def hash_dir(self, rel):
+        path = os.path.join(self.src_dir, rel)
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        cached = self.cache.get(rel)
+        if self.trust_dir_mtime and cached is not None and cached[0] == mtime_ns:
+            return cached
+
+        h = hashlib.blake2b(digest_size=16)
+        subdirs = []
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for e in entries:
+            try:
+                st = e.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append(e.name)
+                h.update(encode("d\0{0}\0{1}\0{2}\0{3}\n".format(e.name, st.st_mode, st.st_uid, st.st_gid)))
+            else:
+                h.update(encode("f\0{0}\0{1}\0{2}\0{3}\0{4}\0{5}\n".format(e.name, st.st_mode, st.st_uid, st.st_gid, st.st_size, st.st_mtime_ns)))
+        self.files += len(entries)
+
+        # a change within the timestamp granularity of the scan wouldn't move the mtime
+        if mtime_ns >= (self.started - catalog.RACY_WINDOW) * 10**9:
+            mtime_ns = None
+        return [mtime_ns, h.hexdigest(), subdirs]
+
+    def compute(self):
+        self.started = time.time()
+        dirs = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as pool:
+            pending = {pool.submit(self.hash_dir, ""): ""}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    rel = pending.pop(future)
+                    try:
+                        state = future.result()
+                    except OSError as e:
+                        self.on_warning("{0}: Cannot read: {1}".format(rel or ".", e.strerror))
+                        state = [None, "error {0}".format(e.errno), []]
+                    dirs[rel] = state
+                    for name in state[2]:
+                        child = os.path.join(rel, name)
+                        pending[pool.submit(self.hash_dir, child)] = child
+
+        # merkle tree, every directory hash covers its own entries and the hashes of its subdirectories
+        tree = {}
+        for rel in sorted(dirs, key=lambda r: r.count("/") + 1 if r else 0, reverse=True):
+            mtime_ns, own, subdirs = dirs[rel]
+            h = hashlib.blake2b(own.encode(), digest_size=16)
+            for name in subdirs:
+                h.update(encode("{0}\0{1}\n".format(name, tree.pop(os.path.join(rel, name)))))
+            tree[rel] = h.hexdigest()
+
+        self.cache = dirs
+        return tree[""]
@@ -0,0 +1,133 @@
+import os, time, json, threading, contextlib, collections
+
+spans = []
+spans_lock = threading.Lock()
+local = threading.local()
+run_started = None
+
+class Span:
+    name = None
+    task = None
+    started = None
+    wall = None
+    cpu = None
+    bytes = 0
+    files = 0
+
+    def __init__(self, name, task):
+        self.name = name
+        self.task = task
+
+    def add(self, bytes=0, files=0):
+        self.bytes += bytes
+        self.files += files
+
+    def as_dict(self):
+        return {
+            'task': self.task,
+            'phase': self.name,
+            'started': self.started,
+            'wall_seconds': self.wall,
+            'cpu_seconds': self.cpu,
+            'bytes': self.bytes,
+            'files': self.files,
+        }
+
+def init():
+    global run_started
+    run_started = time.time()
+    with spans_lock:
+        del spans[:]
+
+def get_task():
+    return getattr(local, 'task', None)
+
+@contextlib.contextmanager
+def task(name):
+    prev = get_task()
+    local.task = name
+    try:
+        yield
+    finally:
+        local.task = prev
+
+# cpu time is taken for the whole process, it includes worker threads
+# (compression, copying) but also any task running concurrently
+@contextlib.contextmanager
+def span(name, task=None):
+    s = Span(name, task or get_task())
+    s.started = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield s
+    finally:
+        s.wall = time.perf_counter() - wall_start
+        s.cpu = time.process_time() - cpu_start
+        with spans_lock:
+            spans.append(s)
+
+def get_spans():
+    with spans_lock:
+        return list(spans)
+
+def get_totals():
+    totals = collections.OrderedDict()
+    for s in get_spans():
+        key = (s.task or "", s.name)
+        if key not in totals:
+            totals[key] = {'wall': 0.0, 'cpu': 0.0, 'bytes': 0, 'files': 0, 'count': 0}
+        t = totals[key]
+        t['wall'] += s.wall
+        t['cpu'] += s.cpu
+        t['bytes'] += s.bytes
+        t['files'] += s.files
+        t['count'] += 1
+    return totals
+
+def write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def write_json(path, name, code):
+    data = {
+        'name': name,
+        'started': run_started,
+        'duration_seconds': time.time() - run_started,
+        'code': code,
+        'spans': [s.as_dict() for s in get_spans()],
+    }
+    write_atomic(path, json.dumps(data, indent=2))
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def write_prometheus(path, name, code):
+    totals = get_totals()
+    config_label = 'config="{0}"'.format(escape_label(name))
+
+    lines = []
+    for metric, field, help in [
+        ('backups_rotate_phase_seconds', 'wall', 'Wall time spent in a phase'),
+        ('backups_rotate_phase_cpu_seconds', 'cpu', 'Process CPU time spent in a phase'),
+        ('backups_rotate_phase_bytes', 'bytes', 'Bytes processed in a phase'),
+        ('backups_rotate_phase_files', 'files', 'Files processed in a phase'),
+    ]:
+        lines.append("# HELP {0} {1}".format(metric, help))
+        lines.append("# TYPE {0} gauge".format(metric))
+        for (task, phase), t in totals.items():
+            lines.append('{0}{{{1},task="{2}",phase="{3}"}} {4}'.format(metric, config_label, escape_label(task), escape_label(phase), t[field]))
+
+    lines.append("# HELP backups_rotate_last_run_timestamp_seconds Time the last run started")
+    lines.append("# TYPE backups_rotate_last_run_timestamp_seconds gauge")
+    lines.append("backups_rotate_last_run_timestamp_seconds{{{0}}} {1}".format(config_label, run_started))
+    lines.append("# HELP backups_rotate_last_run_duration_seconds Duration of the last run")
+    lines.append("# TYPE backups_rotate_last_run_duration_seconds gauge")
+    lines.append("backups_rotate_last_run_duration_seconds{{{0}}} {1}".format(config_label, time.time() - run_started))
+    lines.append("# HELP backups_rotate_last_run_success Whether all tasks of the last run succeeded")
+    lines.append("# TYPE backups_rotate_last_run_success gauge")
+    lines.append("backups_rotate_last_run_success{{{0}}} {1}".format(config_label, 1 if code == 0 else 0))
+
+    write_atomic(path, "\n".join(lines) + "\n")
@@ -0,0 +1,203 @@
+import bisect, functools
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+import utils
+
+Part = namedtuple('Part', ['date_from', 'date_to', 'file_to_keep'])
+Plan = namedtuple('Plan', ['parts', 'keep', 'delete'])
+
+def plan_delete_older_than(entries, delete_older_than, base_date):
+    interval = utils.get_interval_from_str(delete_older_than)
+
+    keep = []
+    delete = []
+    for entry in entries:
+        if utils.get_date_diff_in_seconds(entry.date, base_date) >= interval:
+            delete.append(entry)
+        else:
+            keep.append(entry)
+    return Plan((), tuple(keep), tuple(delete))
+
+Retention = namedtuple('Retention', ['periods', 'parts', 'align'])
+
+PERIODS = ('hourly', 'daily', 'weekly', 'monthly', 'yearly')
+ALIGNS = (None, 'hour', 'day')
+DAY = 24 * 60 * 60
+
+def parse_retention(config):
+    config = dict(config)
+    counts = [(period, int(config.pop(period) or 0)) for period in PERIODS if period in config]
+    periods = tuple((period, count) for period, count in counts if count)
+    parts = config.pop('parts', None) or ()
+    if isinstance(parts, str):
+        parts = parts.split(",")
+    parts = tuple(utils.get_interval_from_str(str(p).strip()) for p in parts)
+    align = config.pop('align', None)
+    if config:
+        raise ValueError("unknown retention options: {0}".format(", ".join(sorted(config))))
+    if align not in ALIGNS:
+        raise ValueError("retention align must be one of hour, day")
+    if any(count < 0 for period, count in counts):
+        raise ValueError("retention counts can't be negative")
+    if any(not p for p in parts):
+        raise ValueError("retention parts must be durations like 6h, 1d or 7d")
+    return Retention(periods, parts, align)
+
+def day_parts_to_retention(clean_day_parts):
+    return Retention((), tuple(int(p.strip()) * DAY for p in clean_day_parts.split(",")), 'day')
+
+def get_period_start(date, period):
+    if period == 'hourly':
+        return date.replace(minute=0, second=0, microsecond=0)
+    day = datetime.combine(date.date(), time.min)
+    if period == 'daily':
+        return day
+    elif period == 'weekly':
+        return day - timedelta(days=day.weekday())
+    elif period == 'monthly':
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+def shift_period(start, period, n):
+    if period == 'hourly':
+        return start - timedelta(hours=n)
+    elif period == 'daily':
+        return start - timedelta(days=n)
+    elif period == 'weekly':
+        return start - timedelta(weeks=n)
+    elif period == 'monthly':
+        year, month = divmod(start.year * 12 + start.month - 1 - n, 12)
+        return start.replace(year=year, month=month + 1)
+    return start.replace(year=start.year - n)
+
+def get_parts_end(align, base_date):
+    if align == 'hour':
+        return base_date.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    elif align == 'day':
+        return datetime.combine(base_date.date(), time.min) + timedelta(days=1)
+    return base_date + timedelta(microseconds=1)
+
+@functools.lru_cache(maxsize=64)
+def get_part_bounds(parts, end):
+    # parts are counted back newest first, search works on them oldest first
+    bounds = []
+    for seconds in parts:
+        start = end - timedelta(seconds=seconds)
+        bounds.append((start, end))
+        end = start
+    bounds.reverse()
+    return [b[0] for b in bounds], [b[1] for b in bounds]
+
+def make_part(start, end, entry, as_days):
+    # whole day parts are shown as inclusive dates, like clean_day_parts always did
+    if as_days:
+        return Part(start.date(), (end - timedelta(days=1)).date(), entry)
+    return Part(start, end, entry)
+
+# whole day parts have inclusive date bounds, the others end right before date_to
+def is_in_part(part, date):
+    if isinstance(part.date_from, datetime):
+        return part.date_from <= date < part.date_to
+    return part.date_from <= date.date() <= part.date_to
+
+# keepers are the entries kept for the parts, oldest part first
+def make_parts(retention, base_date, keepers):
+    starts, ends = get_part_bounds(retention.parts, get_parts_end(retention.align, base_date))
+    as_days = retention.align == 'day' and all(p % DAY == 0 for p in retention.parts)
+    return [make_part(start, end, entry, as_days) for start, end, entry in zip(starts, ends, keepers)][::-1]
+
+# every part keeps its oldest backup, so the kept one doesn't change while parts move forward
+def plan_parts(entries, retention, base_date, is_usable, kept):
+    starts, ends = get_part_bounds(retention.parts, get_parts_end(retention.align, base_date))
+    files_to_keep = [None] * len(starts)
+
+    # entries are sorted by date, so the first one hitting a part is the oldest in it
+    for idx, entry in enumerate(entries):
+        i = bisect.bisect_right(starts, entry.date) - 1
+        if i >= 0 and entry.date < ends[i] and files_to_keep[i] is None and (is_usable is None or is_usable(entry)):
+            files_to_keep[i] = idx
+            kept.add(idx)
+
+    return make_parts(retention, base_date, [entries[idx] if idx is not None else None for idx in files_to_keep])
+
+@functools.lru_cache(maxsize=64)
+def get_period_bounds(period, count, current):
+    return [(shift_period(current, period, n), shift_period(current, period, n - 1)) for n in range(count)]
+
+# keepers maps period starts to the entries kept for them
+def make_period_parts(period, count, base_date, keepers):
+    bounds = get_period_bounds(period, count, get_period_start(base_date, period))
+    return [Part(start, end, keepers.get(start)) for start, end in bounds]
+
+# grandfather-father-son, the newest backup of each of the last n calendar periods is kept
+def plan_periods(entries, period, count, base_date, is_usable, kept):
+    current = get_period_start(base_date, period)
+    window_start = shift_period(current, period, count - 1)
+    window_end = shift_period(current, period, -1)
+
+    keepers = {}
+    last_key = None
+    for idx in range(len(entries) - 1, -1, -1):
+        entry = entries[idx]
+        if entry.date >= window_end:
+            continue
+        if entry.date < window_start:
+            break
+        key = get_period_start(entry.date, period)
+        if key != last_key and (is_usable is None or is_usable(entry)):
+            keepers[key] = entry
+            kept.add(idx)
+            last_key = key
+
+    return make_period_parts(period, count, base_date, keepers)
+
+def plan_retention(entries, retention, base_date, is_usable=None):
+    kept = set()
+    parts = []
+    for period, count in retention.periods:
+        parts.extend(plan_periods(entries, period, count, base_date, is_usable, kept))
+    if retention.parts:
+        parts.extend(plan_parts(entries, retention, base_date, is_usable, kept))
+
+    keep = tuple(entries[idx] for idx in sorted(kept))
+    delete = tuple(e for idx, e in enumerate(entries) if idx not in kept)
+    return Plan(tuple(parts), keep, delete)
+
+def plan_day_parts(entries, clean_day_parts, base_date, is_usable=None):
+    return plan_retention(entries, day_parts_to_retention(clean_day_parts), base_date, is_usable)
+
+# an incremental archive is useless without the archives it was made on top of,
+# they are kept as long as something kept depends on them
+def keep_parents(plan, get_parent):
+    by_name = {e.name: e for e in plan.delete}
+    keep = list(plan.keep)
+    stack = list(plan.keep)
+    while stack:
+        parent = by_name.pop(get_parent(stack.pop()), None)
+        if parent is not None:
+            keep.append(parent)
+            stack.append(parent)
+
+    if len(keep) == len(plan.keep):
+        return plan
+    kept = set(e.name for e in keep)
+    keep.sort(key=lambda e: (e.date, e.name))
+    return Plan(plan.parts, tuple(keep), tuple(e for e in plan.delete if e.name not in kept))
+
+# entries rejected by is_usable (corrupt backups) are never kept for a part,
+# get_parent returns the name of the archive an entry depends on
+def plan_rotation(entries, base_date, delete_older_than=None, clean_day_parts=None, is_usable=None, retention=None, get_parent=None):
+    if delete_older_than is not None:
+        plan = plan_delete_older_than(entries, delete_older_than, base_date)
+    elif retention is not None:
+        if not isinstance(retention, Retention):
+            retention = parse_retention(retention)
+        plan = plan_retention(entries, retention, base_date, is_usable)
+    elif clean_day_parts:
+        plan = plan_day_parts(entries, clean_day_parts, base_date, is_usable)
+    else:
+        return Plan((), tuple(entries), ())
+
+    if get_parent is not None:
+        plan = keep_parents(plan, get_parent)
+    return plan
@@ -0,0 +1,52 @@
+import threading, collections
+import report
+
+DEFAULT_TAIL_SIZE = 64 * 1024
+MAX_LINE_SIZE = 4096
+
+class OutputTail:
+    limit = None
+    size = 0
+    lines_total = 0
+
+    def __init__(self, limit=DEFAULT_TAIL_SIZE):
+        self.limit = limit
+        self.lines = collections.deque()
+        self.lock = threading.Lock()
+
+    def add(self, line):
+        line = line[:MAX_LINE_SIZE]
+        with self.lock:
+            self.lines.append(line)
+            self.size += len(line) + 1
+            self.lines_total += 1
+            while self.size > self.limit and len(self.lines) > 1:
+                self.size -= len(self.lines.popleft()) + 1
+
+    def get(self):
+        with self.lock:
+            skipped = self.lines_total - len(self.lines)
+            text = "\n".join(self.lines)
+        if skipped:
+            return "[{0} earlier lines skipped]\n{1}".format(skipped, text)
+        return text
+
+class OutputReader(threading.Thread):
+    def __init__(self, pipe, tail=None, on_line=None):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.tail = tail if tail is not None else OutputTail()
+        self.on_line = report.bind_section(on_line or report.log_output)
+
+    def run(self):
+        # reads while the child runs, so a chatty child never blocks on a full pipe
+        with self.pipe:
+            for raw in iter(lambda: self.pipe.readline(MAX_LINE_SIZE), b""):
+                line = raw.decode(errors="replace").rstrip("\n")
+                self.tail.add(line)
+                self.on_line(line)
+
+def capture(process, tail=None, on_line=None, pipe=None):
+    reader = OutputReader(pipe or process.stdout, tail, on_line)
+    reader.start()
+    return reader
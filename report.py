@@ -1,9 +1,6 @@
 import sys, datetime
-import os, sys, datetime, smtplib, random
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-import utils
+import os, re, sys, datetime, threading, contextlib, tempfile, io
+import utils, metrics
 
 template = """\
 <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
@@ -11,15 +8,67 @@ template = """\
 <head></head>
 <body>{content}</body></html>"""
 
-output = None
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+TEXT_LOG_MEMORY_SIZE = 1024 * 1024
 
-html_escape_table = { "&": "&amp;", '"': "&quot;", "'": "&apos;", ">": "&gt;", "<": "&lt;", }
+class Builder:
+    chunks = None
+    size = 0
+
+    def __init__(self):
+        self.chunks = []
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+    def extend(self, builder):
+        self.chunks.extend(builder.chunks)
+        self.size += builder.size
+
+    def getvalue(self, limit=None):
+        if limit is None or self.size <= limit:
+            return "".join(self.chunks)
+
+        # chunks are whole log entries, so cutting between them keeps the html valid
+        size = 0
+        for i, chunk in enumerate(self.chunks):
+            size += len(chunk)
+            if size > limit:
+                return "".join(self.chunks[:i])
+        return "".join(self.chunks)
+
+# tasks running concurrently log into their own sections which are
+# appended to the output in task order once everything is done
+class Section(Builder):
+    prefix = None
+
+    def __init__(self, prefix=None):
+        super().__init__()
+        self.prefix = prefix
+
+output = Builder()
+# plain text copy of everything logged, created on the first log line
+text_log = None
+
+local = threading.local()
+output_lock = threading.Lock()
+
+html_escape_table = str.maketrans({ "&": "&amp;", '"': "&quot;", "'": "&apos;", ">": "&gt;", "<": "&lt;", })
 def html_escape(text):
-     return "".join(html_escape_table.get(c,c) for c in text)
+    return text.translate(html_escape_table)
+
+html_whitespace_regex = re.compile("\n|  ")
+html_whitespace = { "\n": "<br/>", "  ": "&nbsp;&nbsp;" }
+def html_whitespace_escape(html):
+    if "\n" not in html and "  " not in html:
+        return html
+    return html_whitespace_regex.sub(lambda m: html_whitespace[m.group(0)], html)
 
 def init():
-    global output
-    output = ""
+    global output, text_log
+    output = Builder()
+    text_log = None
 
 def log_name(name):
     log_text("Name: {0}".format(name))
@@ -33,9 +82,24 @@ def log_command(cmd):
     log_html("<div><pre style='margin: 0; padding: 0'><b>&gt; {0}</b></pre></div>".format(html_escape(cmd)))
     log_text(cmd)
 
-def get_html():
-    global output
-    return template.format(content=output)
+def get_html(limit=None):
+    with output_lock:
+        content = output.getvalue(limit)
+    if limit is not None and output.size > limit:
+        content += "<div style='margin: 3px; color: red'>Report truncated to {0}, the full log is attached</div>".format(utils.format_size(limit))
+    return template.format(content=content)
+
+def get_text_log_gz():
+    import gzip, shutil
+    buf = io.BytesIO()
+    with output_lock:
+        if text_log is None:
+            return gzip.compress(b"")
+        text_log.seek(0)
+        with gzip.GzipFile(filename="log.txt", mode="wb", fileobj=buf) as f:
+            shutil.copyfileobj(text_log, f)
+        text_log.seek(0, io.SEEK_END)
+    return buf.getvalue()
 
 def log_warn(txt):
     log_text("[WARN] {0}".format(txt))
@@ -54,15 +118,117 @@ def log(txt):
     log_html(html_escape(txt))
 
 def log_text(txt):
-    sys.stdout.write("{0}\033[0m\n".format(txt))
+    global text_log
+    section = getattr(local, 'section', None)
+    if section is not None and section.prefix is not None:
+        txt = "[{0}] {1}".format(section.prefix, txt)
+    with output_lock:
+        sys.stdout.write("{0}\033[0m\n".format(txt))
+        if text_log is None:
+            text_log = tempfile.SpooledTemporaryFile(max_size=TEXT_LOG_MEMORY_SIZE, mode="w+b")
+        text_log.write("{0}\n".format(txt).encode(errors="replace"))
 
 def log_html(html):
-    global output
-    html = html.replace("\n", "<br/>").replace("  ", "&nbsp;&nbsp;")
-    output += html + "\n"
+    html = html_whitespace_escape(html) + "\n"
+    section = getattr(local, 'section', None)
+    if section is not None:
+        section.append(html)
+    else:
+        with output_lock:
+            output.append(html)
+
+def log_progress(txt):
+    log_text(txt)
+
+def log_output(txt):
+    log_text(txt)
+
+def get_section():
+    return getattr(local, 'section', None)
+
+@contextlib.contextmanager
+def use_section(section):
+    prev = get_section()
+    local.section = section
+    try:
+        yield section
+    finally:
+        local.section = prev
+
+def bind_section(fn):
+    section = get_section()
+    def wrapper(*args, **kwargs):
+        with use_section(section):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def add_section(section):
+    with output_lock:
+        output.extend(section)
+
+def log_timings(totals):
+    if not totals:
+        return
+
+    log_text("Timings:")
+    rows = []
+    for (task, phase), t in totals.items():
+        log_text("{0:>24s} {1:>10s} {2:8.2f}s wall {3:8.2f}s cpu {4:>10s} {5:8d} files".format(
+            task, phase, t['wall'], t['cpu'], utils.format_size(t['bytes']), t['files']))
+        rows.append("<tr><td>{0}</td><td>{1}</td><td align='right'>{2:.2f}s</td><td align='right'>{3:.2f}s</td><td align='right'>{4}</td><td align='right'>{5}</td></tr>".format(
+            html_escape(task), html_escape(phase), t['wall'], t['cpu'], utils.format_size(t['bytes']), t['files']))
+
+    log_html("<table style='margin: 3px; font-family: monospace; border-collapse: collapse' border='1' cellpadding='3'>"
+             "<tr><th>Task</th><th>Phase</th><th>Wall</th><th>CPU</th><th>Bytes</th><th>Files</th></tr>" + "".join(rows) + "</table>")
+
+class Mailer:
+    # keeps one SMTP connection open between reports, reconnecting when the server dropped it
+    conn = None
+    key = None
+
+    def get_connection(self, host, port, user, password):
+        import smtplib
+        key = (host, port, user)
+        if self.conn is not None and self.key == key:
+            try:
+                if self.conn.noop()[0] == 250:
+                    return self.conn
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.close()
+
+        conn = smtplib.SMTP(host, port=port)
+        if user is not None and password is not None:
+            conn.login(user, password)
+        self.conn = conn
+        self.key = key
+        return conn
+
+    def sendmail(self, host, port, user, password, from_addr, to_addrs, msg):
+        import smtplib
+        try:
+            self.get_connection(host, port, user, password).sendmail(from_addr, to_addrs, msg)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self.get_connection(host, port, user, password).sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        import smtplib
+        if self.conn is None:
+            return
+        try:
+            self.conn.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.conn = None
+        self.key = None
+
+def send(config, code, mailer=None):
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.application import MIMEApplication
 
-def send(config, code):
-    global output
     now = datetime.datetime.now()
     dateStr = now.strftime("%Y-%m-%d %H:%M")
 
@@ -78,19 +244,29 @@ def send(config, code):
     mail_smtp_port = config['mail'].get('smtp_port', 25)
     mail_smtp_user = config['mail'].get('smtp_user')
     mail_smtp_pass = config['mail'].get('smtp_pass')
+    mail_max_body_size = config['mail'].get('max_body_size', DEFAULT_MAX_BODY_SIZE)
 
     recps = mail_recipients.split(',')
 
-    msg = MIMEMultipart('alternative')
-    msg.attach(MIMEText(get_html(), 'html'))
+    msg = MIMEMultipart('mixed')
+    msg.attach(MIMEText(get_html(mail_max_body_size), 'html'))
+    if output.size > mail_max_body_size:
+        attachment = MIMEApplication(get_text_log_gz(), 'gzip')
+        attachment.add_header('Content-Disposition', 'attachment', filename="log.txt.gz")
+        msg.attach(attachment)
 
     msg['Subject'] = subject
     msg['From'] = mail_from
     msg['To'] = ",".join(recps)
 
-    s = smtplib.SMTP(mail_smtp_host, port=mail_smtp_port)
-    if mail_smtp_user is not None and mail_smtp_pass is not None:
-        s.login(mail_smtp_user, mail_smtp_pass)
-    s.sendmail(msg['From'], recps, msg.as_string())
-    s.quit()
+    with metrics.span("smtp", task="mail"):
+        if mailer is not None:
+            mailer.sendmail(mail_smtp_host, mail_smtp_port, mail_smtp_user, mail_smtp_pass, msg['From'], recps, msg.as_string())
+            return
+
+        s = smtplib.SMTP(mail_smtp_host, port=mail_smtp_port)
+        if mail_smtp_user is not None and mail_smtp_pass is not None:
+            s.login(mail_smtp_user, mail_smtp_pass)
+        s.sendmail(msg['From'], recps, msg.as_string())
+        s.quit()
 
@@ -0,0 +1,180 @@
+import os, sys, json, zlib, bisect, tarfile
+import archive
+
+# extraction keeps absolute symlinks and ownership, the archive is our own backup
+EXTRACT_ARGS = {'filter': 'fully_trusted'} if hasattr(tarfile, 'fully_trusted_filter') else {}
+
+class RestoreError(Exception):
+    pass
+
+def get_index_path(path):
+    return path + archive.INDEX_EXTENSION
+
+def load_index(path):
+    try:
+        with open(get_index_path(path), "rb") as f:
+            data = json.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        raise RestoreError("{0}: no index, the archive wasn't created with seekable: true".format(path))
+    except (OSError, ValueError, zlib.error) as e:
+        raise RestoreError("{0}: cannot read index: {1}".format(path, e))
+    if data.get('version') != archive.INDEX_VERSION:
+        raise RestoreError("{0}: unsupported index version".format(path))
+    return data
+
+def decompress_block(compress, data):
+    if compress == 'gzip':
+        return zlib.decompress(data, 31)
+    if archive.zstd_decompress is None:
+        raise RestoreError("zstd archives require python 3.14 or the zstandard package")
+    return archive.zstd_decompress(data)
+
+# a read-only view of the tar stream, only the blocks it is read from are decompressed
+class BlockReader:
+    def __init__(self, f, index):
+        self.f = f
+        self.compress = index['compress']
+        self.u_starts = [b[0] for b in index['blocks']]
+        self.c_starts = [b[1] for b in index['blocks']]
+        self.block = None
+        self.buf = b""
+        self.pos = 0
+        self.blocks_read = 0
+
+    def load_block(self, i):
+        self.f.seek(self.c_starts[i])
+        size = self.c_starts[i + 1] - self.c_starts[i] if i + 1 < len(self.c_starts) else -1
+        self.buf = decompress_block(self.compress, self.f.read(size))
+        self.block = i
+        self.blocks_read += 1
+
+    def seek(self, offset):
+        if self.compress == 'store':
+            self.f.seek(offset)
+            return
+        i = bisect.bisect_right(self.u_starts, offset) - 1
+        if i != self.block:
+            self.load_block(i)
+        self.pos = offset - self.u_starts[i]
+
+    def read(self, n=-1):
+        if self.compress == 'store':
+            return self.f.read(n)
+
+        out = bytearray()
+        while n < 0 or len(out) < n:
+            if self.pos >= len(self.buf):
+                if self.block + 1 >= len(self.u_starts):
+                    break
+                self.load_block(self.block + 1)
+                self.pos = 0
+            take = len(self.buf) - self.pos if n < 0 else min(n - len(out), len(self.buf) - self.pos)
+            out += self.buf[self.pos:self.pos + take]
+            self.pos += take
+        return bytes(out)
+
+def normalize(name):
+    name = name.strip("/")
+    while name.startswith("./"):
+        name = name[2:]
+    return "" if name == "." else name
+
+def is_selected(name, paths):
+    return any(not p or name == p or name.startswith(p + "/") for p in paths)
+
+class Restorer:
+    def __init__(self, path):
+        self.path = path
+        self.index = load_index(path)
+        self.offsets = {normalize(name): offset for name, offset in self.index['members']}
+        self.f = open(path, "rb")
+        self.reader = BlockReader(self.f, self.index)
+
+    def close(self):
+        self.f.close()
+
+    def find(self, paths):
+        paths = [normalize(p) for p in paths]
+        return [(name, offset) for name, offset in self.index['members'] if normalize(name) and is_selected(normalize(name), paths)]
+
+    # the requested paths no member is selected by
+    def find_unmatched(self, paths):
+        names = [normalize(name) for name, _ in self.index['members']]
+        return [p for p in paths if not any(name and is_selected(name, [normalize(p)]) for name in names)]
+
+    def open_member(self, offset):
+        self.reader.seek(offset)
+        tf = tarfile.open(fileobj=self.reader, mode="r|")
+        return tf, tf.next()
+
+    def extract(self, paths, dest_dir, on_member=None):
+        members = self.find(paths)
+        names = set(normalize(name) for name, _ in members)
+        dirs = []
+        for name, offset in members:
+            tf, tarinfo = self.open_member(offset)
+            if tarinfo.islnk() and normalize(tarinfo.linkname) not in names:
+                # the file the link points to isn't restored, its content is extracted in place of the link
+                target_offset = self.offsets.get(normalize(tarinfo.linkname))
+                if target_offset is None:
+                    raise RestoreError("{0}: link target {1} not in the index".format(tarinfo.name, tarinfo.linkname))
+                tf, target = self.open_member(target_offset)
+                target.name = tarinfo.name
+                tarinfo = target
+            if tarinfo.isdir():
+                dirs.append((tf, tarinfo))
+                tf.extract(tarinfo, dest_dir, set_attrs=False, **EXTRACT_ARGS)
+            else:
+                tf.extract(tarinfo, dest_dir, **EXTRACT_ARGS)
+            if on_member is not None:
+                on_member(tarinfo.name)
+
+        # directory attributes are set last, extracting their content would change the mtime
+        for tf, tarinfo in reversed(dirs):
+            path = os.path.join(dest_dir, tarinfo.name)
+            tf.chown(tarinfo, path, False)
+            tf.utime(tarinfo, path)
+            tf.chmod(tarinfo, path)
+        return len(members)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Extracts files from a seekable backup archive, reading only the blocks holding them")
+    parser.add_argument("archive")
+    parser.add_argument("paths", nargs="*", help="files or directories to restore, relative to the backed up directory")
+    parser.add_argument("-C", "--directory", default=".", help="directory to extract into")
+    parser.add_argument("--list", action='store_true', help="list the matching members instead of extracting them")
+    parser.add_argument("-v", "--verbose", action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        restorer = Restorer(args.archive)
+    except (OSError, RestoreError) as e:
+        sys.stderr.write("{0}\n".format(e))
+        return 1
+
+    try:
+        # like tar, the matching paths are still restored when some others don't match
+        unmatched = restorer.find_unmatched(args.paths)
+        if args.list:
+            for name, _ in restorer.find(args.paths or [""]):
+                print(name)
+        elif not args.paths:
+            sys.stderr.write("no paths given, use tar to extract the whole archive\n")
+            return 1
+        else:
+            on_member = print if args.verbose else None
+            count = restorer.extract(args.paths, args.directory, on_member)
+            sys.stderr.write("Restored {0} members, {1} blocks read\n".format(count, restorer.reader.blocks_read))
+        if unmatched:
+            sys.stderr.write("no members match {0}\n".format(", ".join(unmatched)))
+            return 1
+        return 0
+    except (OSError, RestoreError, tarfile.TarError, zlib.error) as e:
+        sys.stderr.write("{0}\n".format(e))
+        return 1
+    finally:
+        restorer.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import time, hmac, hashlib, threading, collections, datetime, http.client, concurrent.futures
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit, quote
+import report
+
+DEFAULT_REGION = "us-east-1"
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+# the part size doubles every this many parts, so even 5MB parts reach the 5TB object limit
+PARTS_PER_SIZE = 900
+# larger objects can't be copied by a single request
+MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 1024 * 1024 * 1024
+DEFAULT_UPLOAD_THREADS = 4
+RETRIES = 3
+EMPTY_HASH = hashlib.sha256(b"").hexdigest()
+
+class S3Error(Exception):
+    status = None
+    code = None
+
+    def __init__(self, status, code, message):
+        super().__init__("{0} {1}: {2}".format(status, code, message))
+        self.status = status
+        self.code = code
+
+def strip_ns(tag):
+    return tag.rsplit("}", 1)[-1]
+
+def find_all(root, name):
+    return [el for el in root.iter() if strip_ns(el.tag) == name]
+
+def find_text(root, name, default=None):
+    for el in root:
+        if strip_ns(el.tag) == name:
+            return el.text
+    return default
+
+# errors of complete and copy requests can come with status 200
+def check_error(resp, data):
+    if b"<Error>" in data:
+        root = ET.fromstring(data)
+        raise S3Error(resp.status, find_text(root, "Code"), find_text(root, "Message"))
+
+def hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+def uri_quote(txt, safe="-_.~"):
+    return quote(txt, safe=safe)
+
+class Client:
+    endpoint = None
+    bucket = None
+    region = None
+    access_key = None
+    secret_key = None
+    virtual_host = None
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region=DEFAULT_REGION, virtual_host=False, timeout=60):
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.virtual_host = virtual_host
+        self.timeout = timeout
+        # one keep-alive connection per thread, uploads run in parallel
+        self.local = threading.local()
+
+    def get_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            host = "{0}.{1}".format(self.bucket, self.host) if self.virtual_host else self.host
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = cls(host, timeout=self.timeout)
+            self.local.conn = conn
+        return conn
+
+    def close_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def get_path(self, key):
+        if self.virtual_host:
+            return "/" + uri_quote(key, safe="-_.~/")
+        return "/" + self.bucket + "/" + uri_quote(key, safe="-_.~/")
+
+    def sign(self, method, path, query, headers, payload_hash, now=None):
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = now.strftime("%Y%m%d")
+
+        headers['host'] = "{0}.{1}".format(self.bucket, self.host) if self.virtual_host else self.host
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+
+        canonical_query = "&".join("{0}={1}".format(uri_quote(k), uri_quote(v)) for k, v in sorted(query.items()))
+        names = sorted(k.lower() for k in headers)
+        lower = {k.lower(): str(v).strip() for k, v in headers.items()}
+        canonical_headers = "".join("{0}:{1}\n".format(k, lower[k]) for k in names)
+        signed_headers = ";".join(names)
+        canonical_request = "\n".join([method, path, canonical_query, canonical_headers, signed_headers, payload_hash])
+
+        scope = "{0}/{1}/s3/aws4_request".format(datestamp, self.region)
+        string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+        key = hmac_sha256(("AWS4" + self.secret_key).encode(), datestamp)
+        key = hmac_sha256(key, self.region)
+        key = hmac_sha256(key, "s3")
+        key = hmac_sha256(key, "aws4_request")
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        headers['Authorization'] = "AWS4-HMAC-SHA256 Credential={0}/{1}, SignedHeaders={2}, Signature={3}".format(
+            self.access_key, scope, signed_headers, signature)
+
+    def request(self, method, key="", query=None, body=b"", headers=None, ok=(200,)):
+        query = query or {}
+        path = self.get_path(key)
+        payload_hash = hashlib.sha256(body).hexdigest() if body else EMPTY_HASH
+
+        for attempt in range(RETRIES):
+            req_headers = dict(headers or {})
+            self.sign(method, path, query, req_headers, payload_hash)
+            url = path
+            if query:
+                url += "?" + "&".join("{0}={1}".format(uri_quote(k), uri_quote(v)) if v != "" else uri_quote(k)
+                                      for k, v in sorted(query.items()))
+            try:
+                conn = self.get_connection()
+                conn.request(method, url, body=body, headers=req_headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException):
+                self.close_connection()
+                if attempt == RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt)
+                continue
+
+            if resp.status in ok:
+                return resp, data
+            if resp.status >= 500 and attempt < RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            code, message = resp.reason, data[:200].decode(errors="replace")
+            if data.startswith(b"<"):
+                try:
+                    root = ET.fromstring(data)
+                    code, message = find_text(root, "Code", code), find_text(root, "Message", message)
+                except ET.ParseError:
+                    pass
+            raise S3Error(resp.status, code, message)
+
+    def list_objects(self, prefix, delimiter="/"):
+        token = None
+        while True:
+            query = {'list-type': "2", 'prefix': prefix, 'delimiter': delimiter}
+            if token:
+                query['continuation-token'] = token
+            resp, data = self.request("GET", query=query)
+            root = ET.fromstring(data)
+            for el in find_all(root, "Contents"):
+                yield find_text(el, "Key"), int(find_text(el, "Size", "0"))
+            if find_text(root, "IsTruncated") != "true":
+                return
+            token = find_text(root, "NextContinuationToken")
+
+    def head_object(self, key):
+        return self.get_object_size(key) is not None
+
+    def get_object_size(self, key):
+        try:
+            resp, _ = self.request("HEAD", key)
+            return int(resp.getheader("Content-Length"))
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def get_object(self, key):
+        try:
+            resp, data = self.request("GET", key)
+            return data
+        except S3Error as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def put_object(self, key, data):
+        self.request("PUT", key, body=data)
+
+    def delete_object(self, key):
+        self.request("DELETE", key, ok=(200, 204))
+
+    def get_copy_source(self, key):
+        return quote("/" + self.bucket + "/" + key)
+
+    def copy_object(self, src_key, dst_key, size=None, threads=DEFAULT_UPLOAD_THREADS):
+        if size is None:
+            size = self.get_object_size(src_key)
+        if size is not None and size > MAX_COPY_SIZE:
+            self.copy_multipart(src_key, dst_key, size, threads)
+            return
+        resp, data = self.request("PUT", dst_key, headers={'x-amz-copy-source': self.get_copy_source(src_key)})
+        check_error(resp, data)
+
+    # large objects are copied range by range into a multipart upload, all on the server
+    def copy_multipart(self, src_key, dst_key, size, threads):
+        upload_id = self.create_multipart_upload(dst_key)
+        try:
+            ranges = [(start, min(start + COPY_PART_SIZE, size) - 1) for start in range(0, size, COPY_PART_SIZE)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+                futures = [pool.submit(self.upload_part_copy, src_key, dst_key, upload_id, i + 1, byte_range)
+                           for i, byte_range in enumerate(ranges)]
+                etags = [f.result() for f in futures]
+            self.complete_multipart_upload(dst_key, upload_id, etags)
+        except BaseException:
+            self.abort_multipart_upload(dst_key, upload_id)
+            raise
+
+    def upload_part_copy(self, src_key, key, upload_id, number, byte_range):
+        headers = {
+            'x-amz-copy-source': self.get_copy_source(src_key),
+            'x-amz-copy-source-range': "bytes={0}-{1}".format(*byte_range),
+        }
+        resp, data = self.request("PUT", key, query={'partNumber': str(number), 'uploadId': upload_id}, headers=headers)
+        check_error(resp, data)
+        return find_text(ET.fromstring(data), "ETag")
+
+    def create_multipart_upload(self, key):
+        resp, data = self.request("POST", key, query={'uploads': ""})
+        return find_text(ET.fromstring(data), "UploadId")
+
+    def upload_part(self, key, upload_id, number, data):
+        resp, _ = self.request("PUT", key, query={'partNumber': str(number), 'uploadId': upload_id}, body=data)
+        return resp.getheader("ETag")
+
+    def complete_multipart_upload(self, key, upload_id, etags):
+        body = "<CompleteMultipartUpload>{0}</CompleteMultipartUpload>".format("".join(
+            "<Part><PartNumber>{0}</PartNumber><ETag>{1}</ETag></Part>".format(i + 1, etag) for i, etag in enumerate(etags)))
+        resp, data = self.request("POST", key, query={'uploadId': upload_id}, body=body.encode())
+        check_error(resp, data)
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.request("DELETE", key, query={'uploadId': upload_id}, ok=(200, 204, 404))
+
+class MultipartWriter:
+    # parts are uploaded while the archive is still being written, at most threads parts
+    # are buffered so memory stays bounded by the current part size * (threads + 1)
+    def __init__(self, client, key, part_size=DEFAULT_PART_SIZE, threads=DEFAULT_UPLOAD_THREADS):
+        self.client = client
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = threads
+        self.pending = collections.deque()
+        self.etags = []
+        self.buf = bytearray()
+        self.upload_id = None
+        self.last_part = None
+
+    # an upload has at most MAX_PARTS parts, they grow so large archives still fit
+    def get_part_size(self, number):
+        return min(self.part_size << ((number - 1) // PARTS_PER_SIZE), MAX_PART_SIZE)
+
+    def write(self, data):
+        self.buf += data
+        while True:
+            part_size = self.get_part_size(len(self.etags) + len(self.pending) + 1)
+            if len(self.buf) < part_size:
+                break
+            self.submit(bytes(self.buf[:part_size]))
+            del self.buf[:part_size]
+
+    def submit(self, part):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(self.key)
+        number = len(self.etags) + len(self.pending) + 1
+        if number > MAX_PARTS:
+            raise S3Error(None, "TooManyParts", "{0}: the archive doesn't fit in {1} parts".format(self.key, MAX_PARTS))
+        self.pending.append(self.pool.submit(self.client.upload_part, self.key, self.upload_id, number, part))
+        while len(self.pending) > self.max_pending:
+            self.etags.append(self.pending.popleft().result())
+
+    # uploads everything, the object appears only with commit()
+    def finish(self):
+        if self.upload_id is not None:
+            if self.buf:
+                self.submit(bytes(self.buf))
+            self.buf = bytearray()
+            while self.pending:
+                self.etags.append(self.pending.popleft().result())
+        else:
+            self.last_part = bytes(self.buf)
+        self.pool.shutdown()
+
+    def commit(self):
+        if self.upload_id is not None:
+            self.client.complete_multipart_upload(self.key, self.upload_id, self.etags)
+        else:
+            self.client.put_object(self.key, self.last_part)
+
+    def abort(self):
+        self.pool.shutdown(cancel_futures=True)
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(self.key, self.upload_id)
+            except (S3Error, OSError) as e:
+                report.log_warn("Cannot abort upload of {0}: {1}".format(self.key, e))
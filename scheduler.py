@@ -0,0 +1,59 @@
+import concurrent.futures
+
+class Job:
+    fn = None
+    dests = None
+    after = None
+
+    done = False
+    result = None
+
+    def __init__(self, fn, dests, after):
+        self.fn = fn
+        self.dests = frozenset(dests)
+        self.after = list(after)
+
+    def is_ready(self):
+        return all(job.done for job in self.after)
+
+class Scheduler:
+    max_workers = None
+    jobs = None
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max(1, max_workers)
+        self.jobs = []
+
+    def add(self, fn, dests=(), after=()):
+        job = Job(fn, dests, after)
+        self.jobs.append(job)
+        return job
+
+    def run(self):
+        pending = list(self.jobs)
+        running = {}
+        # jobs touching the same destination never run at the same time
+        locked_dests = set()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for job in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if not job.is_ready() or job.dests & locked_dests:
+                        continue
+                    pending.remove(job)
+                    locked_dests |= job.dests
+                    running[pool.submit(job.fn)] = job
+
+                if not running:
+                    raise RuntimeError("task dependencies can't be satisfied")
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    locked_dests -= job.dests
+                    job.result = future.result()
+                    job.done = True
+
+        return [job.result for job in self.jobs]
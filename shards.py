@@ -0,0 +1,137 @@
+import os, stat, json, heapq, concurrent.futures
+import archive, report, utils
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+# every tar entry costs a header block, so many small files weigh more than their size
+ENTRY_COST = 512
+SIZE_THREADS = 16
+
+def get_shard_name(i, compress):
+    return "shard-{0:03d}.{1}".format(i, archive.COMPRESS_EXTENSIONS[compress])
+
+def get_tree_size(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(st.st_mode):
+        return ENTRY_COST + st.st_size
+
+    total = ENTRY_COST
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(e.path)
+                            total += ENTRY_COST
+                        else:
+                            total += ENTRY_COST + e.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total
+
+# top-level entries are spread over the shards largest first, each one goes to the lightest shard
+def plan_shards(src_dir, count):
+    names = sorted(os.listdir(src_dir))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SIZE_THREADS) as pool:
+        sizes = list(pool.map(lambda name: get_tree_size(os.path.join(src_dir, name)), names))
+
+    count = max(1, min(count, len(names)))
+    members = [[] for _ in range(count)]
+    totals = [0] * count
+    heap = [(0, i) for i in range(count)]
+    for size, name in sorted(zip(sizes, names), key=lambda x: (-x[0], x[1])):
+        total, i = heapq.heappop(heap)
+        members[i].append(name)
+        totals[i] = total + size
+        heapq.heappush(heap, (totals[i], i))
+    return [sorted(m) for m in members], totals
+
+class ShardedStats(archive.Stats):
+    def __init__(self, shards):
+        super().__init__()
+        self.shards = shards
+
+    @property
+    def bytes_in(self):
+        return sum(s.bytes_in for s in self.shards)
+
+    @property
+    def bytes_out(self):
+        return sum(s.bytes_out for s in self.shards)
+
+    @property
+    def files(self):
+        return sum(s.files for s in self.shards)
+
+def create_shard(src_dir, path, compress, threads, level, on_warning, throttle, checksum, seekable, select, stats):
+    with open(path, "wb") as f:
+        stats, errors = archive.create_archive(src_dir, f, compress, threads, level, on_warning, throttle, checksum,
+                                               select=select, stats=stats, progress=False, seekable=seekable)
+        f.flush()
+        os.fsync(f.fileno())
+    if stats.index is not None:
+        with open(path + archive.INDEX_EXTENSION, "wb") as f:
+            f.write(stats.index)
+    return stats, errors
+
+# the shards are written into dest_dir next to an index describing them, a top-level entry
+# created after planning goes to the first shard so nothing is missed
+def create_sharded_archive(src_dir, dest_dir, compress, count, threads=None, level=None, on_warning=report.log_warn,
+                           throttle=None, checksum=None, seekable=False):
+    members, sizes = plan_shards(src_dir, count)
+    for i, (names, size) in enumerate(zip(members, sizes)):
+        report.log_msg("Shard {0}: {1} entries, {2}".format(i, len(names), utils.format_size(size)))
+
+    planned = [set(names) for names in members]
+    others = set().union(*planned[1:])
+    selects = [lambda name: name not in others] + [names.__contains__ for names in planned[1:]]
+
+    os.makedirs(dest_dir)
+    shard_stats = [archive.Stats() for _ in members]
+    stats = ShardedStats(shard_stats)
+    threads = max(1, (threads or os.cpu_count() or 1) // len(members))
+    on_warning = report.bind_section(on_warning)
+
+    progress = archive.ProgressReporter(stats)
+    progress.start()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(members)) as pool:
+            futures = [pool.submit(create_shard, src_dir, os.path.join(dest_dir, get_shard_name(i, compress)), compress, threads,
+                                   level, on_warning, throttle, checksum, seekable, select, s)
+                       for i, (select, s) in enumerate(zip(selects, shard_stats))]
+            results = [f.result() for f in futures]
+    finally:
+        progress.stop()
+
+    index = {
+        'version': INDEX_VERSION,
+        'compress': compress,
+        'shards': [{
+            'name': get_shard_name(i, compress),
+            'members': names,
+            'size': s.bytes_out,
+            'bytes_in': s.bytes_in,
+            'files': s.files,
+            'checksum': s.checksum,
+        } for i, (names, (s, _)) in enumerate(zip(members, results))],
+    }
+    with open(os.path.join(dest_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+    return stats, sum(errors for _, errors in results), index
+
+def read_index(path):
+    try:
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,237 @@
+import sys, json, bisect, argparse, collections
+from collections import namedtuple
+from datetime import datetime, timedelta
+import utils, planner, catalog
+
+DayState = namedtuple('DayState', ['date', 'kept', 'max_gap', 'entries', 'plan'])
+
+week_names = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
+
+def get_max_gap(entries):
+    gap = timedelta(0)
+    for prev, entry in zip(entries, entries[1:]):
+        gap = max(gap, entry.date - prev.date)
+    return gap
+
+# the newest entry of each of the last count periods, the new entry is always the newest of its period
+class PeriodKeepers:
+    period = None
+    count = None
+    keepers = None
+    current = None
+    current_end = None
+
+    def __init__(self, period, count):
+        self.period = period
+        self.count = count
+        self.keepers = {}
+
+    def add(self, entry, keep, release):
+        if self.current is None or not self.current <= entry.date < self.current_end:
+            self.current = planner.get_period_start(entry.date, self.period)
+            self.current_end = planner.shift_period(self.current, self.period, -1)
+            window_start = planner.shift_period(self.current, self.period, self.count - 1)
+            for key in [key for key in self.keepers if key < window_start]:
+                release(self.keepers.pop(key))
+
+        previous = self.keepers.get(self.current)
+        self.keepers[self.current] = entry
+        keep(entry)
+        if previous is not None:
+            release(previous)
+
+# the rotation planner applied to entries appended one by one, each planned at its own date;
+# only what the new entry and moved part boundaries change is planned again
+class Rotation:
+    max_age = None
+    retention = None
+    entries = None
+    deleted = None
+    refs = None
+    periods = None
+    parts_end = None
+    part_keepers = None
+
+    def __init__(self, delete_older_than=None, clean_day_parts=None, retention=None):
+        self.entries = []
+        self.deleted = []
+        if delete_older_than is not None:
+            self.max_age = utils.get_interval_from_str(delete_older_than)
+        elif retention is not None:
+            self.retention = retention if isinstance(retention, planner.Retention) else planner.parse_retention(retention)
+        elif clean_day_parts:
+            self.retention = planner.day_parts_to_retention(clean_day_parts)
+        if self.retention is not None:
+            # how many periods and parts keep each entry
+            self.refs = collections.Counter()
+            self.periods = [PeriodKeepers(period, count) for period, count in self.retention.periods]
+
+    def keep(self, entry):
+        self.refs[entry.name] += 1
+
+    # released entries are deleted unless something keeps them again
+    def release(self, entry):
+        self.refs[entry.name] -= 1
+        if self.refs[entry.name] == 0:
+            del self.refs[entry.name]
+            self.deleted.append(entry)
+
+    def add(self, entry):
+        self.entries.append(entry)
+        if self.max_age is not None:
+            # entries are sorted by date, the expired ones are at the front
+            n = 0
+            while n < len(self.entries) and utils.get_date_diff_in_seconds(self.entries[n].date, entry.date) >= self.max_age:
+                n += 1
+            self.deleted = self.entries[:n]
+            del self.entries[:n]
+        elif self.retention is not None:
+            self.deleted = []
+            for period in self.periods:
+                period.add(entry, self.keep, self.release)
+            if self.retention.parts:
+                self.plan_parts(entry)
+            self.deleted.append(entry)
+
+            # an entry released by one rule can be kept again by a later one
+            deleted = {e.name: e for e in self.deleted if e.name not in self.refs}
+            self.deleted = sorted(deleted.values(), key=lambda e: e.date)
+            for e in self.deleted:
+                self.entries.remove(e)
+
+    def plan_parts(self, entry):
+        parts_end = planner.get_parts_end(self.retention.align, entry.date)
+        starts, ends = planner.get_part_bounds(self.retention.parts, parts_end)
+        if parts_end == self.parts_end:
+            # parts keep their oldest entry, the new one is kept only by an empty part
+            i = bisect.bisect_right(starts, entry.date) - 1
+            if i >= 0 and entry.date < ends[i] and self.part_keepers[i] is None:
+                self.part_keepers[i] = entry
+                self.keep(entry)
+            return
+
+        # the boundaries moved, every part takes the oldest entry now inside it
+        dates = [e.date for e in self.entries]
+        keepers = []
+        for start, end in zip(starts, ends):
+            i = bisect.bisect_left(dates, start)
+            keepers.append(self.entries[i] if i < len(dates) and dates[i] < end else None)
+        for e in keepers:
+            if e is not None:
+                self.keep(e)
+        for e in self.part_keepers or ():
+            if e is not None:
+                self.release(e)
+        self.parts_end = parts_end
+        self.part_keepers = keepers
+
+    def get_plan(self, base_date):
+        parts = []
+        if self.retention is not None:
+            for period in self.periods:
+                parts.extend(planner.make_period_parts(period.period, period.count, base_date, period.keepers))
+            if self.retention.parts:
+                parts.extend(planner.make_parts(self.retention, base_date, self.part_keepers))
+        return planner.Plan(tuple(parts), tuple(self.entries), tuple(self.deleted))
+
+def simulate(days, start_date, interval="1d", delete_older_than=None, clean_day_parts=None, retention=None):
+    step = timedelta(seconds=utils.get_interval_from_str(interval))
+    end_date = start_date + timedelta(days=days)
+
+    rotation = Rotation(delete_older_than=delete_older_than, clean_day_parts=clean_day_parts, retention=retention)
+    date = start_date
+    day_end = datetime.combine(start_date.date(), datetime.min.time()) + timedelta(days=1)
+    while date < end_date:
+        # a backup followed by a rotation, entries stay sorted as dates only grow
+        name = date.strftime("%Y-%m-%d_%H%M%S_sim")
+        rotation.add(catalog.Entry(name, date, 0, 'file'))
+        last_date = date
+
+        date += step
+        if date >= day_end or date >= end_date:
+            entries = rotation.entries
+            yield DayState(day_end - timedelta(days=1), len(entries), get_max_gap(entries), tuple(entries), rotation.get_plan(last_date))
+            while day_end <= date:
+                day_end += timedelta(days=1)
+
+# day parts have inclusive date bounds, other parts end right before date_to
+def get_part_days(part):
+    if isinstance(part.date_from, datetime):
+        return part.date_from.date(), (part.date_to - timedelta(microseconds=1)).date()
+    return part.date_from, part.date_to
+
+def render_calendar(state, colorize=True):
+    backup_days = set(e.date.date() for e in state.entries)
+    parts = [get_part_days(p) + (1 + i % 6,) for i, p in enumerate(state.plan.parts)] if state.plan else []
+
+    end_date = state.date.date()
+    while (end_date + timedelta(days=1)).month == end_date.month:
+        end_date += timedelta(days=1)
+    start_date = min(backup_days) if backup_days else end_date
+    start_date = start_date.replace(day=1)
+
+    lines = []
+    date = start_date
+    line = ""
+    month = None
+    while date <= end_date:
+        if date.month != month:
+            if line:
+                lines.append(line)
+            month = date.month
+            lines.append("{0:^21}".format("{0:4}-{1:02}".format(date.year, date.month)))
+            lines.append(" ".join(week_names))
+            line = "   " * date.weekday()
+
+        cell = "{0:2}".format(date.day)
+        if colorize:
+            for p in parts:
+                if p[0] <= date <= p[1]:
+                    cell = "\033[4{0};1m{1}".format(p[2], cell)
+            if date in backup_days:
+                cell = "\033[31;1m" + cell
+            line += cell + "\033[0m "
+        else:
+            line += cell + ("*" if date in backup_days else " ")
+
+        if date.weekday() == 6:
+            lines.append(line)
+            line = ""
+        date += timedelta(days=1)
+    if line:
+        lines.append(line)
+
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates a retention policy in memory")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--start", default="2015-08-02")
+    parser.add_argument("--interval", default="1d", help="backup interval")
+    parser.add_argument("--delete-older-than")
+    parser.add_argument("--clean-day-parts")
+    parser.add_argument("--retention", type=json.loads, help='e.g. {"hourly": 24, "daily": 7, "weekly": 4, "monthly": 12}')
+    parser.add_argument("--calendar", action='store_true', help="render the calendar of the final state")
+    parser.add_argument("--json", action='store_true')
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start, "%Y-%m-%d")
+    states = simulate(args.days, start_date, args.interval, delete_older_than=args.delete_older_than, clean_day_parts=args.clean_day_parts,
+                      retention=args.retention and planner.parse_retention(args.retention))
+
+    state = None
+    if args.json:
+        out = []
+        for state in states:
+            out.append({"date": state.date.strftime("%Y-%m-%d"), "kept": state.kept, "max_gap": state.max_gap.total_seconds()})
+        json.dump(out, sys.stdout)
+        sys.stdout.write("\n")
+    else:
+        for state in states:
+            print("{0} kept: {1:4} max gap: {2}".format(state.date.strftime("%Y-%m-%d"), state.kept, state.max_gap))
+
+    if args.calendar and state is not None:
+        print(render_calendar(state, colorize=sys.stdout.isatty()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import json, time, zlib
+import catalog, utils
+
+STATE_PREFIX = "snapshot_"
+VERSION = 1
+# incremental archives are named <date>_<name>.inc.<ext>
+INCREMENTAL_MARKER = ".inc."
+
+def get_state_name(name):
+    return STATE_PREFIX + utils.get_valid_filename(name) + ".json.gz"
+
+def is_incremental_name(name):
+    return INCREMENTAL_MARKER in name
+
+# what the last archive of the chain contained, kept with the other state of the destination
+class State:
+    storage = None
+    name = None
+    src_dir = None
+    archive = None
+    full = None
+    entries = None
+
+    def __init__(self, storage, name, src_dir):
+        self.storage = storage
+        self.name = get_state_name(name)
+        self.src_dir = src_dir
+        self.entries = {}
+
+    def read(self):
+        try:
+            data = self.storage.read_state(self.name)
+            if data is None:
+                return False
+            data = json.loads(zlib.decompress(data))
+            if data['version'] != VERSION or data['src'] != self.src_dir:
+                return False
+            self.archive = data['archive']
+            self.full = data['full']
+            self.entries = data['entries']
+        except (OSError, ValueError, KeyError, TypeError, zlib.error):
+            return False
+        return True
+
+    def save(self):
+        data = {
+            'version': VERSION,
+            'src': self.src_dir,
+            'archive': self.archive,
+            'full': self.full,
+            'entries': self.entries,
+        }
+        self.storage.write_state(self.name, zlib.compress(json.dumps(data, separators=(",", ":")).encode()))
+
+# decides which entries go into the archive and records the state of all of them
+class Snapshot:
+    def __init__(self, previous=None):
+        self.previous = previous or {}
+        self.entries = {}
+        self.started = time.time()
+
+    def check(self, arcname, st):
+        state = [st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino]
+        # a change within the timestamp granularity of the scan wouldn't move the times
+        if max(st.st_mtime_ns, st.st_ctime_ns) >= (self.started - catalog.RACY_WINDOW) * 10**9:
+            state[0] = None
+        self.entries[arcname] = state
+        previous = self.previous.get(arcname)
+        return previous is None or previous[0] is None or previous != state
+
+    def get_deleted(self):
+        return sorted(name for name in self.previous if name not in self.entries)
@@ -0,0 +1,197 @@
+import os, json, time, contextlib
+from urllib.parse import urlsplit
+import catalog, trash, utils
+
+class LocalWriter:
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.f = open(self.tmp_path, "wb")
+
+    def write(self, data):
+        self.f.write(data)
+
+    def finish(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+    def commit(self):
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        self.f.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LocalStorage:
+    is_local = True
+    path = None
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self, name):
+        return os.path.exists(self.path + name)
+
+    def load_catalog(self, write=True):
+        return catalog.load(self.path, write=write)
+
+    def transaction(self):
+        return catalog.transaction(self.path)
+
+    def open_write(self, name):
+        return LocalWriter(self.path + name)
+
+    def write_file(self, name, data):
+        path = self.path + name
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def read_state(self, name):
+        try:
+            with open(os.path.join(catalog.get_state_dir(self.path), name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_state(self, name, data):
+        path = os.path.join(catalog.get_state_dir(self.path), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def rename(self, name, new_name):
+        os.rename(self.path + name, self.path + new_name)
+
+    def delete(self, name):
+        trash.move_to_trash(self.path, name)
+
+    # deleted backups are only moved to the trash, they are removed in the background
+    def purge(self, threads):
+        trash.purge(self.path, threads)
+
+class ObjectCatalog(catalog.Catalog):
+    # object stores have no directory mtime to validate the stored catalog against, the
+    # listing is always fetched and the stored catalog only supplies checksums and info
+    def __init__(self, storage):
+        super().__init__(storage.url)
+        self.storage = storage
+
+    def read(self):
+        data = self.storage.read_state(catalog.CATALOG_FILE)
+        if data is None:
+            return False
+        try:
+            return self.load_data(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            self.entries = {}
+            return False
+
+    def scan(self):
+        old_entries = self.entries
+        self.entries = {}
+        self.latest = None
+
+        for name, size in self.storage.list():
+            if utils.is_tmp_filename(name) or utils.is_sidecar_filename(name):
+                continue
+            date = utils.get_date_from_filename(name)
+            if date is None:
+                continue
+
+            old = old_entries.get(name)
+            if old is not None and old.kind == 'file':
+                self.put(old)
+            else:
+                self.put(catalog.Entry(name, date, size, 'file'))
+
+    def save(self):
+        self.dir_mtime_ns = 0
+        self.saved_at = time.time()
+        self.storage.write_state(catalog.CATALOG_FILE, json.dumps(self.dump_data()).encode())
+
+class S3Storage:
+    is_local = False
+    url = None
+    prefix = None
+    part_size = None
+    upload_threads = None
+
+    def __init__(self, url, config):
+        import s3
+        parts = urlsplit(url)
+        self.url = url
+        self.prefix = parts.path.lstrip("/")
+        if self.prefix and not self.prefix.endswith("/"):
+            self.prefix += "/"
+
+        region = config.get('region', s3.DEFAULT_REGION)
+        endpoint = config.get('endpoint', "https://s3.{0}.amazonaws.com".format(region))
+        access_key = config.get('access_key', os.environ.get('AWS_ACCESS_KEY_ID'))
+        secret_key = config.get('secret_key', os.environ.get('AWS_SECRET_ACCESS_KEY'))
+        if not access_key or not secret_key:
+            raise ValueError("s3 credentials missing, set s3 access_key and secret_key or AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
+
+        self.client = s3.Client(endpoint, parts.netloc, access_key, secret_key, region=region,
+                                virtual_host=config.get('virtual_host', False))
+        self.part_size = utils.get_size_from_str(config.get('part_size')) or s3.DEFAULT_PART_SIZE
+        self.upload_threads = config.get('upload_threads', s3.DEFAULT_UPLOAD_THREADS)
+
+    def get_state_key(self, name):
+        return self.prefix + catalog.STATE_DIR + "/" + name
+
+    def list(self):
+        for key, size in self.client.list_objects(self.prefix):
+            yield key[len(self.prefix):], size
+
+    def exists(self, name):
+        return self.client.head_object(self.prefix + name)
+
+    def load_catalog(self, write=True):
+        cat = ObjectCatalog(self)
+        cat.read()
+        cat.scan()
+        return cat
+
+    @contextlib.contextmanager
+    def transaction(self):
+        cat = self.load_catalog()
+        yield cat
+        cat.save()
+
+    def open_write(self, name):
+        import s3
+        return s3.MultipartWriter(self.client, self.prefix + name, self.part_size, self.upload_threads)
+
+    def write_file(self, name, data):
+        self.client.put_object(self.prefix + name, data)
+
+    def read_state(self, name):
+        return self.client.get_object(self.get_state_key(name))
+
+    def write_state(self, name, data):
+        self.client.put_object(self.get_state_key(name), data)
+
+    def rename(self, name, new_name):
+        self.client.copy_object(self.prefix + name, self.prefix + new_name, threads=self.upload_threads)
+        self.client.delete_object(self.prefix + name)
+
+    def delete(self, name):
+        self.client.delete_object(self.prefix + name)
+
+    def purge(self, threads):
+        pass
+
+def is_remote(dest):
+    return dest.startswith("s3://")
+
+def get_storage(dest, config):
+    if dest.startswith("s3://"):
+        return S3Storage(dest, config.get('s3') or {})
+    return LocalStorage(dest)
@@ -0,0 +1,168 @@
+import os, sys, time, json, argparse, tempfile, shutil, datetime, platform, subprocess, contextlib
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utils, report, planner, catalog, archive, trash
+
+parser = argparse.ArgumentParser(description="Benchmarks of scanning, rotation and archiving hot paths")
+parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated numbers of entries in synthetic destinations")
+parser.add_argument("--small-files", type=int, default=10000, help="number of files in the small files source tree")
+parser.add_argument("--huge-files", type=int, default=4, help="number of files in the huge files source tree")
+parser.add_argument("--huge-size", type=int, default=64, help="size of every huge file in MB")
+parser.add_argument("--repeat", type=int, default=3, help="repetitions, the best time is reported")
+parser.add_argument("--compress", default="store,gzip", help="comma separated archive modes to benchmark")
+parser.add_argument("--tmpdir", help="where to generate synthetic data")
+parser.add_argument("--output", help="write JSON results to file instead of stdout")
+args = parser.parse_args()
+
+base_date = datetime.datetime(2020, 1, 1)
+results = []
+
+def log(txt):
+    sys.stderr.write(txt + "\n")
+
+def measure(name, fn, size=None, units=None, setup=None):
+    best = None
+    for i in range(args.repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+
+    result = {"name": name, "size": size, "seconds": best}
+    if units:
+        result["per_second"] = units / best if best > 0 else None
+    results.append(result)
+    log("{0:<40} {1:>10} {2:10.4f}s".format(name, size if size is not None else "", best))
+
+def make_names(count):
+    return [(base_date - datetime.timedelta(hours=i)).strftime("%Y-%m-%d_%H%M%S_bench.tgz") for i in range(count)]
+
+def make_dest(root, count):
+    dest = os.path.join(root, "dest_{0}".format(count))
+    os.mkdir(dest)
+    for name in make_names(count):
+        open(os.path.join(dest, name), "w").close()
+    return dest
+
+def make_small_tree(root, count):
+    src = os.path.join(root, "small")
+    per_dir = 1000
+    for i in range(count):
+        d = os.path.join(src, "d{0}".format(i // per_dir))
+        if i % per_dir == 0:
+            os.makedirs(d)
+        with open(os.path.join(d, "f{0}".format(i)), "wb") as f:
+            f.write(os.urandom(1024) * 4)
+    return src
+
+def make_huge_tree(root, count, size_mb):
+    src = os.path.join(root, "huge")
+    os.mkdir(src)
+    chunk = os.urandom(1024 * 1024 // 2) * 2
+    for i in range(count):
+        with open(os.path.join(src, "f{0}".format(i)), "wb") as f:
+            for j in range(size_mb):
+                f.write(chunk)
+    return src
+
+def bench_dest(root, count):
+    dest = make_dest(root, count)
+    names = make_names(count)
+
+    measure("get_date_from_filename", lambda: [utils.get_date_from_filename(n) for n in names], count, count)
+    measure("get_last_date_in_dir", lambda: utils.get_last_date_in_dir(dest), count, count)
+
+    def scan():
+        cat = catalog.Catalog(dest)
+        cat.scan()
+    measure("catalog_scan", scan, count, count)
+
+    def save_and_age():
+        catalog.load(dest)
+        age = time.time() - 60
+        os.utime(dest, (age, age))
+        catalog.load(dest)
+    save_and_age()
+    measure("catalog_load_cached", lambda: catalog.load(dest).last_date(), count, count)
+
+    entries = catalog.load(dest).sorted_entries()
+    measure("plan_clean_day_parts", lambda: planner.plan_rotation(entries, base_date, clean_day_parts="1,1,1,1,1,1,1,7,7,7,30,30,30,365"), count, count)
+    measure("plan_delete_older_than", lambda: planner.plan_rotation(entries, base_date, delete_older_than="30d"), count, count)
+
+    shutil.rmtree(dest)
+
+def bench_delete(root, src, name):
+    dest = os.path.join(root, "dest_delete")
+    os.mkdir(dest)
+    victim = "2020-01-01_000000_victim"
+
+    def setup():
+        shutil.copytree(src, os.path.join(dest, victim))
+
+    def delete():
+        trash.move_to_trash(dest, victim)
+        trash.purge(dest)
+        trash.wait()
+
+    measure("delete_{0}".format(name), delete, setup=setup)
+    measure("rmtree_{0}".format(name), lambda: shutil.rmtree(os.path.join(dest, victim)), setup=setup)
+    shutil.rmtree(dest)
+
+def bench_archive(root, src, name, compress):
+    out = os.path.join(root, "archive.out")
+    total = []
+
+    def run():
+        with open(out, "wb") as f:
+            stats, errors = archive.create_archive(src, f, compress, on_warning=log)
+        total.append(stats.bytes_in)
+
+    measure("archive_{0}_{1}".format(compress, name), run)
+    results[-1]["bytes_in"] = total[-1]
+    results[-1]["bytes_out"] = os.path.getsize(out)
+    results[-1]["mb_per_second"] = total[-1] / results[-1]["seconds"] / 1024 / 1024
+    os.remove(out)
+
+def get_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+report.init()
+
+# stdout is reserved for the results
+root = tempfile.mkdtemp(prefix="backups_rotate_bench_", dir=args.tmpdir)
+try:
+    with contextlib.redirect_stdout(sys.stderr):
+        for size in args.sizes.split(","):
+            bench_dest(root, int(size))
+
+        small = make_small_tree(root, args.small_files)
+        huge = make_huge_tree(root, args.huge_files, args.huge_size)
+
+        bench_delete(root, small, "small_files")
+
+        for compress in args.compress.split(","):
+            bench_archive(root, small, "small_files", compress)
+            bench_archive(root, huge, "huge_files", compress)
+finally:
+    shutil.rmtree(root)
+
+output = {
+    "revision": get_revision(),
+    "python": platform.python_version(),
+    "cpus": os.cpu_count(),
+    "date": datetime.datetime.now().isoformat(),
+    "results": results,
+}
+
+if args.output:
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+else:
+    json.dump(output, sys.stdout, indent=2)
+    sys.stdout.write("\n")
@@ -1,13 +1,16 @@
-import os, time, datetime, sys
+import sys, datetime, configparser
+sys.path.append("..")
+import simulate
 
-os.system ("mkdir -p test_backups test_dir")
-os.system ("touch test_dir/file_to_backup")
-os.system ("rm -f test_backups/*")
+config = configparser.ConfigParser()
+config.read("test.cfg")
+rotate = config['rotate']
 
-i = 0
-while True:
-    bd =  "--basedate \""+(datetime.datetime (2015, 8, 2) + datetime.timedelta (days=i)).strftime ("%Y-%m-%d")+"\""
-    os.system ("python ../backups_rotate.py --force --config test.cfg {0} > /dev/null".format(bd))
-    os.system ("python show_cal.py --config test.cfg {0}".format(bd))
-    i += 1
+states = simulate.simulate(100000, datetime.datetime(2015, 8, 2), rotate.get('interval', '1d'),
+                           delete_older_than=rotate.get('delete_older_than'), clean_day_parts=rotate.get('clean_day_parts'))
+
+for state in states:
+    sys.stdout.write("\033[2J\033[0;0H")
+    print("{0} kept: {1} max gap: {2}".format(state.date.strftime("%Y-%m-%d"), state.kept, state.max_gap))
+    print(simulate.render_calendar(state))
     sys.stdin.read(1)
@@ -0,0 +1,169 @@
+import os, sys, uuid, hashlib, argparse, shutil
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ET
+
+# A stand-in for an S3 compatible object store, good enough for testing the s3 storage backend:
+# path-style buckets, objects, ListObjectsV2, copy and multipart uploads. Signatures are not checked.
+
+parser = argparse.ArgumentParser(description="Minimal S3 compatible server storing objects in a directory")
+parser.add_argument("--root", required=True, help="directory to keep buckets in")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=9000)
+args = parser.parse_args()
+
+def object_path(bucket, key):
+    return os.path.join(args.root, bucket, quote(key, safe=""))
+
+def upload_dir(upload_id):
+    return os.path.join(args.root, ".uploads", upload_id)
+
+def etag_of(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return '"{0}"'.format(h.hexdigest())
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *a):
+        sys.stderr.write("{0} {1}\n".format(self.command, self.path))
+
+    def parse(self):
+        url = urlsplit(self.path)
+        parts = url.path.lstrip("/").split("/", 1)
+        bucket = unquote(parts[0])
+        key = unquote(parts[1]) if len(parts) > 1 else ""
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        os.makedirs(os.path.join(args.root, bucket), exist_ok=True)
+        return bucket, key, query
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_error_xml(self, status, code):
+        self.send(status, "<Error><Code>{0}</Code><Message>{0}</Message></Error>".format(code).encode())
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        if not key:
+            return self.list_objects(bucket, query)
+        path = object_path(bucket, key)
+        if not os.path.exists(path):
+            return self.send_error_xml(404, "NoSuchKey")
+        with open(path, "rb") as f:
+            self.send(200, f.read(), {"ETag": etag_of(path)})
+
+    def do_HEAD(self):
+        bucket, key, query = self.parse()
+        path = object_path(bucket, key)
+        if not os.path.exists(path):
+            return self.send(404)
+        self.send_response(200)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("ETag", etag_of(path))
+        self.end_headers()
+
+    def list_objects(self, bucket, query):
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter", "")
+        keys = sorted(unquote(name) for name in os.listdir(os.path.join(args.root, bucket)))
+        contents = []
+        prefixes = set()
+        for key in keys:
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+                continue
+            size = os.path.getsize(object_path(bucket, key))
+            contents.append("<Contents><Key>{0}</Key><Size>{1}</Size></Contents>".format(escape(key), size))
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><Name>{0}</Name><Prefix>{1}</Prefix>'
+                '<IsTruncated>false</IsTruncated>{2}{3}</ListBucketResult>').format(
+                    escape(bucket), escape(prefix), "".join(contents),
+                    "".join("<CommonPrefixes><Prefix>{0}</Prefix></CommonPrefixes>".format(escape(p)) for p in sorted(prefixes)))
+        self.send(200, body.encode())
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        if "uploadId" in query:
+            d = upload_dir(query["uploadId"])
+            if not os.path.isdir(d):
+                return self.send_error_xml(404, "NoSuchUpload")
+            part = os.path.join(d, "{0:05d}".format(int(query["partNumber"])))
+            with open(part, "wb") as f:
+                f.write(body)
+            return self.send(200, headers={"ETag": etag_of(part)})
+
+        path = object_path(bucket, key)
+        source = self.headers.get("x-amz-copy-source")
+        if source is not None:
+            src_bucket, src_key = unquote(source).lstrip("/").split("/", 1)
+            src_path = object_path(src_bucket, src_key)
+            if not os.path.exists(src_path):
+                return self.send_error_xml(404, "NoSuchKey")
+            shutil.copyfile(src_path, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            return self.send(200, "<CopyObjectResult><ETag>{0}</ETag></CopyObjectResult>".format(etag_of(path)).encode())
+
+        with open(path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+        self.send(200, headers={"ETag": etag_of(path)})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(upload_dir(upload_id))
+            return self.send(200, "<InitiateMultipartUploadResult><Bucket>{0}</Bucket><Key>{1}</Key><UploadId>{2}</UploadId></InitiateMultipartUploadResult>".format(
+                escape(bucket), escape(key), upload_id).encode())
+
+        if "uploadId" in query:
+            d = upload_dir(query["uploadId"])
+            if not os.path.isdir(d):
+                return self.send_error_xml(404, "NoSuchUpload")
+            root = ET.fromstring(body)
+            numbers = [int(el.text) for el in root.iter() if el.tag.endswith("PartNumber")]
+            path = object_path(bucket, key)
+            with open(path + ".tmp", "wb") as out:
+                for number in numbers:
+                    with open(os.path.join(d, "{0:05d}".format(number)), "rb") as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(path + ".tmp", path)
+            shutil.rmtree(d)
+            return self.send(200, "<CompleteMultipartUploadResult><Key>{0}</Key><ETag>{1}</ETag></CompleteMultipartUploadResult>".format(
+                escape(key), etag_of(path)).encode())
+
+        self.send_error_xml(400, "InvalidRequest")
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        if "uploadId" in query:
+            shutil.rmtree(upload_dir(query["uploadId"]), ignore_errors=True)
+            return self.send(204)
+        path = object_path(bucket, key)
+        if os.path.exists(path):
+            os.remove(path)
+        self.send(204)
+
+os.makedirs(os.path.join(args.root, ".uploads"), exist_ok=True)
+server = ThreadingHTTPServer((args.host, args.port), Handler)
+sys.stderr.write("Listening on http://{0}:{1}/\n".format(args.host, args.port))
+server.serve_forever()
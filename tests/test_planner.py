@@ -0,0 +1,154 @@
+import os, sys, random, unittest
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import planner
+from catalog import Entry
+
+def make_entry(date):
+    return Entry(date.strftime("%Y-%m-%d_%H%M%S"), date)
+
+def make_entries(dates):
+    return [make_entry(d) for d in sorted(dates)]
+
+def names(entries):
+    return [e.name for e in entries]
+
+# clean_day_parts as it was before the planner, kept to compare the planner with
+def old_day_parts_keep(entries, clean_day_parts, base_date):
+    parts = []
+    cur_date = base_date.date()
+    for p in clean_day_parts.split(","):
+        days = int(p.strip())
+        start_date = cur_date - timedelta(days - 1)
+        parts.append({"from": start_date, "to": cur_date, "file_to_keep": None})
+        cur_date = start_date - timedelta(1)
+
+    for entry in entries:
+        date = entry.date.date()
+        for p in parts:
+            if p["from"] <= date <= p["to"]:
+                if p["file_to_keep"] is None or p["file_to_keep"].date.date() > date:
+                    p["file_to_keep"] = entry
+    return set(p["file_to_keep"].name for p in parts if p["file_to_keep"] is not None)
+
+class DayPartsTest(unittest.TestCase):
+    def test_same_as_old_algorithm(self):
+        rnd = random.Random(1)
+        for _ in range(300):
+            base_date = datetime(2024, 1, 1) + timedelta(minutes=rnd.randrange(60 * 24 * 400))
+            clean_day_parts = ",".join(str(rnd.randint(1, 10)) for _ in range(rnd.randint(1, 6)))
+            entries = make_entries(set(base_date - timedelta(minutes=rnd.randrange(-60 * 24, 60 * 24 * 60))
+                                       for _ in range(rnd.randint(0, 80))))
+
+            plan = planner.plan_rotation(entries, base_date, clean_day_parts=clean_day_parts)
+            expected = old_day_parts_keep(entries, clean_day_parts, base_date)
+            self.assertEqual(set(names(plan.keep)), expected)
+            self.assertEqual(set(names(plan.delete)), set(names(entries)) - expected)
+
+    def test_parts_show_inclusive_days(self):
+        plan = planner.plan_rotation([], datetime(2024, 3, 13, 15, 0), clean_day_parts="1,2")
+        self.assertEqual([(p.date_from, p.date_to) for p in plan.parts],
+                         [(datetime(2024, 3, 13).date(), datetime(2024, 3, 13).date()),
+                          (datetime(2024, 3, 11).date(), datetime(2024, 3, 12).date())])
+
+class PeriodsTest(unittest.TestCase):
+    base_date = datetime(2024, 3, 13, 15, 30)  # a wednesday
+
+    def test_newest_of_each_period(self):
+        entries = make_entries([datetime(2024, 3, 13, 1), datetime(2024, 3, 13, 12),
+                                datetime(2024, 3, 12, 8), datetime(2024, 3, 12, 20),
+                                datetime(2024, 3, 10, 9), datetime(2024, 3, 4, 9)])
+        plan = planner.plan_rotation(entries, self.base_date, retention={'daily': 2, 'weekly': 2})
+        # daily: today and yesterday, weekly: this week (from monday 11th) and the previous one
+        self.assertEqual(names(plan.keep), ["2024-03-10_090000", "2024-03-12_200000", "2024-03-13_120000"])
+        self.assertEqual(names(plan.delete), ["2024-03-04_090000", "2024-03-12_080000", "2024-03-13_010000"])
+
+    def test_period_parts(self):
+        entries = make_entries([datetime(2024, 2, 20), datetime(2023, 12, 31, 23)])
+        plan = planner.plan_rotation(entries, self.base_date, retention={'monthly': 3, 'yearly': 2})
+        self.assertEqual([(p.date_from, p.date_to, p.file_to_keep and p.file_to_keep.name) for p in plan.parts], [
+            (datetime(2024, 3, 1), datetime(2024, 4, 1), None),
+            (datetime(2024, 2, 1), datetime(2024, 3, 1), "2024-02-20_000000"),
+            (datetime(2024, 1, 1), datetime(2024, 2, 1), None),
+            (datetime(2024, 1, 1), datetime(2025, 1, 1), "2024-02-20_000000"),
+            (datetime(2023, 1, 1), datetime(2024, 1, 1), "2023-12-31_230000"),
+        ])
+
+    def test_unusable_entries_skipped(self):
+        entries = make_entries([datetime(2024, 3, 13, 1), datetime(2024, 3, 13, 12)])
+        plan = planner.plan_rotation(entries, self.base_date, retention={'daily': 1},
+                                     is_usable=lambda e: e.date.hour != 12)
+        self.assertEqual(names(plan.keep), ["2024-03-13_010000"])
+
+    def test_zero_count_ignored(self):
+        entries = make_entries([datetime(2024, 3, 13, 1)])
+        plan = planner.plan_rotation(entries, self.base_date, retention={'daily': 1, 'hourly': 0, 'weekly': ""})
+        self.assertEqual(len(plan.parts), 1)
+        self.assertEqual(names(plan.keep), ["2024-03-13_010000"])
+
+class AlignTest(unittest.TestCase):
+    base_date = datetime(2024, 3, 13, 15, 30)
+
+    def bounds(self, align, parts):
+        retention = planner.Retention((), parts, align)
+        return [(p.date_from, p.date_to) for p in planner.make_parts(retention, self.base_date, [None] * len(parts))]
+
+    def test_no_align(self):
+        self.assertEqual(self.bounds(None, (3600, 7200)), [
+            (datetime(2024, 3, 13, 14, 30, 0, 1), datetime(2024, 3, 13, 15, 30, 0, 1)),
+            (datetime(2024, 3, 13, 12, 30, 0, 1), datetime(2024, 3, 13, 14, 30, 0, 1)),
+        ])
+
+    def test_hour(self):
+        self.assertEqual(self.bounds('hour', (3600, 7200)), [
+            (datetime(2024, 3, 13, 15), datetime(2024, 3, 13, 16)),
+            (datetime(2024, 3, 13, 13), datetime(2024, 3, 13, 15)),
+        ])
+
+    def test_day_with_hour_parts(self):
+        self.assertEqual(self.bounds('day', (6 * 3600, planner.DAY)), [
+            (datetime(2024, 3, 13, 18), datetime(2024, 3, 14)),
+            (datetime(2024, 3, 12, 18), datetime(2024, 3, 13, 18)),
+        ])
+
+    def test_entry_on_boundary(self):
+        entries = make_entries([datetime(2024, 3, 13, 15), datetime(2024, 3, 13, 14, 59, 59)])
+        plan = planner.plan_rotation(entries, self.base_date, retention={'parts': "1h", 'align': 'hour'})
+        self.assertEqual(names(plan.keep), ["2024-03-13_150000"])
+
+class KeepParentsTest(unittest.TestCase):
+    def setUp(self):
+        self.entries = make_entries([datetime(2024, 3, d) for d in range(1, 8)])
+        # full archives on the 1st and 5th, every other one is made on top of the previous day
+        parents = {e.name: (None if e.date.day in (1, 5) else self.entries[i - 1].name) for i, e in enumerate(self.entries)}
+        self.get_parent = lambda entry: parents[entry.name]
+
+    def test_chain_kept(self):
+        plan = planner.Plan((), (self.entries[3],), tuple(e for e in self.entries if e is not self.entries[3]))
+        plan = planner.keep_parents(plan, self.get_parent)
+        self.assertEqual(names(plan.keep), names(self.entries[:4]))
+        self.assertEqual(names(plan.delete), names(self.entries[4:]))
+
+    def test_unchanged_without_dependencies(self):
+        plan = planner.Plan((), (self.entries[4],), tuple(e for e in self.entries if e is not self.entries[4]))
+        self.assertIs(planner.keep_parents(plan, self.get_parent), plan)
+
+    def test_rotation(self):
+        plan = planner.plan_rotation(self.entries, datetime(2024, 3, 7, 12), retention={'daily': 1, 'weekly': 2},
+                                     get_parent=self.get_parent)
+        # the newest of the week (the 7th, made on the 5th) and of the previous week (the 3rd, made on the 1st)
+        self.assertEqual(names(plan.keep), names(self.entries[:3] + self.entries[4:]))
+        self.assertEqual(names(plan.delete), names(self.entries[3:4]))
+
+class ParseRetentionTest(unittest.TestCase):
+    def test_parse(self):
+        retention = planner.parse_retention({'daily': "7", 'monthly': 0, 'parts': "6h, 1d", 'align': 'day'})
+        self.assertEqual(retention, planner.Retention((('daily', 7),), (6 * 3600, planner.DAY), 'day'))
+
+    def test_errors(self):
+        for config in ({'daily': 1, 'hours': 2}, {'align': 'week'}, {'daily': -1}, {'parts': "6x"}):
+            with self.assertRaises(ValueError):
+                planner.parse_retention(config)
+
+if __name__ == "__main__":
+    unittest.main()
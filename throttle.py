@@ -0,0 +1,158 @@
+import os, time, threading
+import report, metrics, utils
+
+# bucket size in seconds of the rate, bounds how bursty a limited stream can get
+BURST_SECONDS = 0.25
+
+OPTIONS = ('read_limit', 'write_limit', 'cpu_limit', 'nice', 'ionice', 'ionice_level')
+# only compression workers are limited by cpu_limit
+CPU_LIMITED_COMPRESS = ('gzip', 'zstd')
+
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {'x86_64': 251, 'aarch64': 30, 'i386': 289, 'i686': 289, 'armv7l': 314, 'ppc64le': 273, 's390x': 282}
+
+class TokenBucket:
+    rate = None
+    burst = None
+    tokens = None
+    last = None
+    waited = 0.0
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else self.rate * BURST_SECONDS
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # takes n tokens and sleeps off the debt, so concurrent consumers share the rate
+    def consume(self, n):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+class Throttle:
+    read = None
+    write = None
+    cpu = None
+    cpu_percent = None
+    nice = None
+    ionice = None
+    ionice_level = None
+
+    def __init__(self, read_limit=None, write_limit=None, cpu_limit=None, nice=None, ionice=None, ionice_level=None):
+        if read_limit:
+            self.read = TokenBucket(read_limit)
+        if write_limit:
+            self.write = TokenBucket(write_limit)
+        if cpu_limit:
+            # cpu seconds per second, 100 is one full cpu
+            self.cpu_percent = cpu_limit
+            self.cpu = TokenBucket(cpu_limit / 100.0, burst=max(cpu_limit / 100.0, 1) * BURST_SECONDS)
+        self.nice = nice
+        if ionice is not None and ionice not in IOPRIO_CLASSES:
+            raise ValueError("ionice must be one of: {0}".format(", ".join(IOPRIO_CLASSES)))
+        self.ionice = ionice
+        self.ionice_level = ionice_level
+
+    def is_active(self):
+        return any(x is not None for x in (self.read, self.write, self.cpu, self.nice, self.ionice))
+
+    def consume_read(self, n):
+        if self.read is not None:
+            self.read.consume(n)
+
+    def consume_write(self, n):
+        if self.write is not None:
+            self.write.consume(n)
+
+    def run_cpu(self, fn, *args):
+        if self.cpu is None:
+            return fn(*args)
+        started = time.thread_time()
+        try:
+            return fn(*args)
+        finally:
+            self.cpu.consume(time.thread_time() - started)
+
+    def format(self):
+        parts = []
+        if self.read is not None:
+            parts.append("read {0}/s".format(utils.format_size(self.read.rate)))
+        if self.write is not None:
+            parts.append("write {0}/s".format(utils.format_size(self.write.rate)))
+        if self.cpu is not None:
+            parts.append("compression cpu {0}%".format(self.cpu_percent))
+        if self.nice is not None:
+            parts.append("nice {0}".format(self.nice))
+        if self.ionice is not None:
+            parts.append("ionice {0}{1}".format(self.ionice, "" if self.ionice_level is None else " {0}".format(self.ionice_level)))
+        return ", ".join(parts)
+
+    def format_waited(self):
+        parts = []
+        for name, bucket in [("read", self.read), ("write", self.write), ("cpu", self.cpu)]:
+            if bucket is not None:
+                parts.append("{0} {1:.1f}s".format(name, bucket.waited))
+        return ", ".join(parts)
+
+    def set_priority(self):
+        if self.nice is not None:
+            tid = threading.get_native_id()
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, max(self.nice, os.getpriority(os.PRIO_PROCESS, tid)))
+            except OSError as e:
+                report.log_warn("Cannot set nice {0}: {1}".format(self.nice, e.strerror))
+        if self.ionice is not None:
+            set_ioprio(IOPRIO_CLASSES[self.ionice], self.ionice_level or 0)
+
+    # threads inherit nice and io priority from the thread creating them, so everything
+    # fn starts (compression and copy workers) runs with the lowered priority too
+    def run(self, fn, *args):
+        if self.nice is None and self.ionice is None:
+            return fn(*args)
+
+        result = []
+        error = []
+        task = metrics.get_task()
+
+        def target():
+            try:
+                with metrics.task(task):
+                    self.set_priority()
+                    result.append(fn(*args))
+            except BaseException as e:
+                error.append(e)
+
+        thread = threading.Thread(target=report.bind_section(target))
+        thread.start()
+        thread.join()
+        if error:
+            raise error[0]
+        return result[0]
+
+def set_ioprio(ioclass, level):
+    import platform, ctypes
+    nr = SYS_IOPRIO_SET.get(platform.machine())
+    if nr is None:
+        report.log_warn("ionice is not supported on {0}".format(platform.machine()))
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(nr, IOPRIO_WHO_PROCESS, 0, (ioclass << IOPRIO_CLASS_SHIFT) | level) != 0:
+        report.log_warn("Cannot set io priority: {0}".format(os.strerror(ctypes.get_errno())))
+
+def from_config(config):
+    return Throttle(read_limit=utils.get_size_from_str(config.get('read_limit')),
+                    write_limit=utils.get_size_from_str(config.get('write_limit')),
+                    cpu_limit=config.get('cpu_limit'),
+                    nice=config.get('nice'),
+                    ionice=config.get('ionice'),
+                    ionice_level=config.get('ionice_level'))
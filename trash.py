@@ -0,0 +1,117 @@
+import os, stat, uuid, threading, time, concurrent.futures
+import report, catalog, metrics
+
+TRASH_DIR = "trash"
+DEFAULT_THREADS = 8
+
+purgers = {}
+purgers_lock = threading.Lock()
+
+def get_trash_dir(dest_dir):
+    return os.path.join(catalog.get_state_dir(dest_dir), TRASH_DIR)
+
+def move_to_trash(dest_dir, filename):
+    trash_dir = get_trash_dir(dest_dir)
+    os.makedirs(trash_dir, exist_ok=True)
+    os.rename(os.path.join(dest_dir, filename), os.path.join(trash_dir, "{0}.{1}".format(filename, uuid.uuid4().hex[:8])))
+
+def unlink_dir_contents(trash_fd, reldir):
+    fd = os.open(reldir, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=trash_fd)
+    try:
+        subdirs = []
+        files = 0
+        with os.scandir(fd) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(os.path.join(reldir, e.name))
+                else:
+                    os.unlink(e.name, dir_fd=fd)
+                    files += 1
+        return subdirs, files
+    finally:
+        os.close(fd)
+
+class Purger(threading.Thread):
+    def __init__(self, trash_dir, threads=DEFAULT_THREADS):
+        super().__init__(daemon=True)
+        self.trash_dir = trash_dir
+        self.threads = threads
+        self.section = report.get_section()
+        self.task = metrics.get_task()
+        self.wakeup = False
+        self.finished = False
+
+    def purge_entry(self, pool, trash_fd, name):
+        st = os.stat(name, dir_fd=trash_fd, follow_symlinks=False)
+        if not stat.S_ISDIR(st.st_mode):
+            os.unlink(name, dir_fd=trash_fd)
+            return 1
+
+        # unlink files level by level in parallel, then remove the directories deepest first
+        dirs = [name]
+        files = 0
+        level = [name]
+        while level:
+            next_level = []
+            for subdirs, count in pool.map(lambda d: unlink_dir_contents(trash_fd, d), level):
+                next_level += subdirs
+                files += count
+            dirs += next_level
+            level = next_level
+
+        for d in reversed(dirs):
+            os.rmdir(d, dir_fd=trash_fd)
+        return files
+
+    def run(self):
+        with report.use_section(self.section), metrics.span("purge", task=self.task) as span:
+            started = time.monotonic()
+            entries = 0
+            files = 0
+            trash_fd = os.open(self.trash_dir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as pool:
+                    # entries moved to trash while purging are picked up by the next listing
+                    while True:
+                        with purgers_lock:
+                            self.wakeup = False
+                        names = os.listdir(trash_fd)
+                        if not names:
+                            with purgers_lock:
+                                if not self.wakeup:
+                                    break
+                            continue
+                        for name in names:
+                            files += self.purge_entry(pool, trash_fd, name)
+                            entries += 1
+            except OSError as err:
+                report.log_warn("Purging {0} failed, it will be retried on the next run: {1}".format(self.trash_dir, err))
+            finally:
+                os.close(trash_fd)
+                with purgers_lock:
+                    self.finished = True
+
+            span.add(files=files)
+            if entries:
+                report.log_state("Purged {0} entries ({1} files) from {2} in {3:.1f}s".format(
+                    entries, files, self.trash_dir, time.monotonic() - started))
+
+def purge(dest_dir, threads=DEFAULT_THREADS):
+    trash_dir = get_trash_dir(dest_dir)
+    if not os.path.isdir(trash_dir):
+        return
+
+    with purgers_lock:
+        purger = purgers.get(trash_dir)
+        if purger is not None and not purger.finished:
+            purger.wakeup = True
+            return
+        purger = Purger(trash_dir, threads)
+        purgers[trash_dir] = purger
+        purger.start()
+
+def wait():
+    with purgers_lock:
+        running = list(purgers.values())
+    for purger in running:
+        purger.join()
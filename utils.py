@@ -32,43 +32,53 @@ def get_interval_from_str(txt):
 
     return secs
 
+date_regex = re.compile(r"^(\d\d\d\d)-(\d\d)-(\d\d)_(\d\d)(\d\d)(\d\d)?")
+
+size_units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+def get_size_from_str(txt):
+    if txt is None:
+        return None
+    if isinstance(txt, int):
+        return txt
+    m = re.match(r"^(\d+)([KMGT]?)B?$", txt.strip().upper())
+    if m is None:
+        raise ValueError("invalid size: {0}".format(txt))
+    return int(m.group(1)) * size_units[m.group(2)]
+
 def get_date_from_filename(filename):
-    m = re.match("^(\d\d\d\d)-(\d\d)-(\d\d)_(\d\d)(\d\d)(\d\d)", filename)
-    if m is not None:
-        year = int(m.group(1))
-        month = int(m.group(2))
-        day = int(m.group(3))
-        hour = int(m.group(4))
-        minute = int(m.group(5))
-        seconds = int(m.group(6))
-        return datetime.datetime(year, month, day, hour, minute, seconds)
-    m = re.match("^(\d\d\d\d)-(\d\d)-(\d\d)_(\d\d)(\d\d)", filename)
-    if m is not None:
-        year = int(m.group(1))
-        month = int(m.group(2))
-        day = int(m.group(3))
-        hour = int(m.group(4))
-        minute = int(m.group(5))
-        return datetime.datetime(year, month, day, hour, minute, 0)
-    return None
+    m = date_regex.match(filename)
+    if m is None:
+        return None
+    year, month, day, hour, minute, seconds = m.groups()
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(seconds or 0))
 
+def is_tmp_filename(filename):
+    return filename.endswith(".tmp") or filename.endswith("_tmp")
+
+# files stored next to a backup, named after it
+sidecar_extensions = (".manifest", ".idx")
+
+def is_sidecar_filename(filename):
+    return filename.endswith(sidecar_extensions)
+
+# a directory of archive shards with an index, it is a single backup
+sharded_extension = ".shards"
 
 def get_last_date_in_dir(dir):
-    lastDate = datetime.datetime.min
-    for filename in os.listdir(dir):
-        if filename.endswith(".tmp") or filename.endswith("_tmp"):
-            continue
-        date = get_date_from_filename(filename)
-        if date is None:
-            continue
-
-        if lastDate < date:
-            lastDate = date
-
-    if lastDate == datetime.datetime.min:
-        return None
-    else:
-        return lastDate
+    lastDate = None
+    with os.scandir(dir) as it:
+        for entry in it:
+            if is_tmp_filename(entry.name) or is_sidecar_filename(entry.name):
+                continue
+            date = get_date_from_filename(entry.name)
+            if date is None:
+                continue
+
+            if lastDate is None or lastDate < date:
+                lastDate = date
+
+    return lastDate
 
 
 def get_date_diff_in_seconds(date, base_date):
@@ -85,3 +95,12 @@ def is_valid_filename_char(x):
 def get_valid_filename(s):
     s = s.replace(" ", "_")
     return "".join(x for x in s if is_valid_filename_char(x))
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(size) < 1024 or unit == "TB":
+            break
+        size /= 1024
+    if unit == "B":
+        return "{0}{1}".format(int(size), unit)
+    return "{0:.1f}{1}".format(size, unit)
@@ -0,0 +1,79 @@
+import os, json, hashlib, multiprocessing, concurrent.futures
+import throttle
+
+MANIFEST_EXTENSION = ".manifest"
+DEFAULT_ALGORITHM = "sha256"
+MANIFEST_VERSION = 1
+READ_SIZE = 1024 * 1024
+
+def get_manifest_path(path):
+    return path + MANIFEST_EXTENSION
+
+def format_checksum(algorithm, digest):
+    return "{0}:{1}".format(algorithm, digest)
+
+def parse_checksum(checksum):
+    algorithm, digest = checksum.split(":", 1)
+    return algorithm, digest
+
+def make_manifest(name, checksum, size, **info):
+    data = {
+        'version': MANIFEST_VERSION,
+        'name': name,
+        'size': size,
+    }
+    if checksum:
+        data['algorithm'], data['checksum'] = parse_checksum(checksum)
+    data.update(info)
+    return json.dumps(data, indent=2).encode()
+
+def read_manifest(path):
+    try:
+        with open(get_manifest_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def get_checksum(path, entry_checksum=None):
+    if entry_checksum:
+        return entry_checksum
+    manifest = read_manifest(path)
+    if manifest is None or 'checksum' not in manifest:
+        return None
+    return format_checksum(manifest['algorithm'], manifest['checksum'])
+
+def hash_file(path, algorithm, read_limit=None):
+    h = hashlib.new(algorithm)
+    bucket = throttle.TokenBucket(read_limit) if read_limit else None
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            if bucket is not None:
+                bucket.consume(len(chunk))
+            h.update(chunk)
+    return h.hexdigest()
+
+# runs in the worker processes, returns None when the file is intact or what is wrong with it
+def verify_file(path, checksum, read_limit=None):
+    algorithm, expected = parse_checksum(checksum)
+    try:
+        actual = hash_file(path, algorithm, read_limit)
+    except OSError as e:
+        return "cannot read: {0}".format(e.strerror)
+    except ValueError as e:
+        return str(e)
+    if actual != expected:
+        return "checksum mismatch, expected {0}, got {1}".format(expected, actual)
+    return None
+
+# yields (name, error) in completion order, the read limit is shared by all processes
+def verify_files(files, processes=None, read_limit=None):
+    processes = max(1, min(processes or os.cpu_count() or 1, len(files)))
+    limit = read_limit / processes if read_limit else None
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=ctx) as pool:
+        futures = {pool.submit(verify_file, path, checksum, limit): name for name, path, checksum in files}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()